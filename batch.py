@@ -0,0 +1,274 @@
+"""
+Headless batch processing, without QGIS, through engine
+
+Run from the folder containing the plugin, with numpy and GDAL installed, e.g.
+    python -m LandSurfaceTemperatureV3.batch "scenes/*.tar.gz" --products lst ndvi
+    python -m LandSurfaceTemperatureV3.batch --bands B4.TIF,B5.TIF,B10.TIF --satellite Landsat8
+    python -m LandSurfaceTemperatureV3.batch "p144r051/*.tar.gz" --series --products lst --output stats
+"""
+
+import argparse, glob, os, sys, time
+
+from . import instrument
+
+
+class consoleCarrier(object):
+
+    """
+    Stands in for mainLST.CarrierTask, reporting to the console instead of a window
+    """
+
+    def __init__(self, verbose=False):
+
+        self.verbose = verbose
+        self.error = None
+        self.done = False
+        self.notification = ""
+        self.recorder = instrument.stageRecorder()
+        self.meter = instrument.workMeter(self.updateProgress)
+
+    def updateProgress(self, num, text):
+
+        """
+        Print updates, if asked to
+        """
+
+        self.notification = text
+        if self.verbose:
+            print("    " + text)
+
+    def setError(self, msg):
+
+        """
+        Keep the first error, the scene is abandoned after it
+        """
+
+        if self.error:
+            return
+        self.error = msg
+        self.done = True
+
+
+def processScene(filePaths, satType, resultStates, settings, verbose=False):
+
+    """
+    Run a scene through the engine, in this thread
+    Returns an error message, or None if the scene was processed
+    """
+
+    from . import engine
+
+    carrier = consoleCarrier(verbose)
+    error = engine.processScene(filePaths, satType, resultStates, settings, carrier)
+
+    if verbose:
+        for record in carrier.recorder.stages:
+            if "peakBytes" in record:
+                memory = "%8.1f MB peak" % (record["peakBytes"] / 2 ** 20)
+            else:
+                memory = "%8.1f MB more resident" % (record["rssIncrease"] / 2 ** 20)
+            print(
+                "    %-10s %7.2f s wall %7.2f s cpu %s"
+                % (record["name"], record["wall"], record["cpu"], memory)
+            )
+    return error
+
+
+def processSeries(scenes, args, settings):
+
+    """
+    Statistics of a product over all scenes, see engine.processSeries
+    """
+
+    from . import engine
+
+    carrier = consoleCarrier(args.verbose)
+    series = []
+    for name, filePaths, satType in scenes:
+        if args.shape:
+            filePaths["Shape"] = args.shape
+        series.append((filePaths, satType))
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    start = time.time()
+    summary = engine.processSeries(series, args.products[0], settings, carrier, args.output or "")
+    for (name, filePaths, satType), record in zip(scenes, summary):
+        if record["error"]:
+            print("%s: skipped - %s" % (name, record["error"]))
+        else:
+            print("%s: %d pixels added" % (name, record["pixels"]))
+
+    added = len([record for record in summary if not (record["error"])])
+    if carrier.error:
+        print("No statistics written - %s" % carrier.error)
+        return 1
+    print(
+        "Statistics of %d of %d scenes written in %.1f seconds"
+        % (added, len(scenes), time.time() - start)
+    )
+    return 0
+
+
+def listScenes(args):
+
+    """
+    Expand the archive globs and band sets into a list of (name, filePaths, satType)
+    """
+
+    scenes = []
+    for pattern in args.inputs:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for path in matches:
+            scenes.append((os.path.basename(path), {"zip": path}, None))
+    for bandSet in args.bands:
+        paths = bandSet.split(",")
+        if len(paths) != 3:
+            raise SystemExit("--bands takes three comma separated files: Red,Near-IR,Thermal-IR")
+        filePaths = dict(zip(("Red", "Near-IR", "Thermal-IR"), paths))
+        name = os.path.splitext(os.path.basename(paths[0]))[0]
+        scenes.append((name, filePaths, args.satellite))
+    return scenes
+
+
+def main(argv=None):
+
+    """
+    Entry point, see --help
+    """
+
+    from . import engine, fileio
+
+    keys = [key for key, name in engine.PRODUCTS]
+
+    parser = argparse.ArgumentParser(description="Land Surface Temperature, in batch")
+    parser.add_argument("inputs", nargs="*", help="Compressed scenes, or globs of them")
+    parser.add_argument(
+        "--bands",
+        action="append",
+        default=[],
+        help="Red,Near-IR,Thermal-IR TIFs of one scene, may be repeated",
+    )
+    parser.add_argument(
+        "--satellite",
+        choices=["Landsat8", "Landsat5"],
+        default="Landsat8",
+        help="Satellite of the --bands scenes",
+    )
+    parser.add_argument("--products", nargs="+", choices=keys, default=["lst"])
+    parser.add_argument("--shape", help="Shapefile to limit calculations to")
+    parser.add_argument("--output", help="Folder for outputs, one subfolder per scene")
+    parser.add_argument("--block-size", type=int, default=0, help="Rows per block, 0 for whole scene")
+    parser.add_argument("--workers", type=int, default=1, help="Worker threads")
+    parser.add_argument("--fused", action="store_true", help="Fused calculation")
+    parser.add_argument(
+        "--no-tables",
+        action="store_true",
+        help="Calculate TOA and BT of each pixel, instead of looking digital numbers up",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Read and write blocks while calculating others, with --block-size",
+    )
+    parser.add_argument(
+        "--virtual", action="store_true", help="Read archives in place, without extracting"
+    )
+    parser.add_argument(
+        "--profile", choices=list(fileio.OUTPUT_PROFILES), default="Plain", help="Output format"
+    )
+    parser.add_argument(
+        "--precision",
+        choices=engine.PRECISIONS,
+        default=engine.PRECISIONS[0],
+        help="dtype of the calculations and outputs",
+    )
+    parser.add_argument(
+        "--multiband", action="store_true", help="Write all outputs as bands of one file"
+    )
+    parser.add_argument(
+        "--aggregate",
+        type=int,
+        default=1,
+        help="Input pixels per side of each output pixel, averaged, e.g. 3 for 90 m",
+    )
+    parser.add_argument(
+        "--crop", action="store_true", help="Only read the area around the shapefile"
+    )
+    parser.add_argument("--cache", action="store_true", help="Reuse outputs and shapefile masks of earlier runs")
+    parser.add_argument("--cache-size", type=float, default=10, help="Cache size (GB)")
+    parser.add_argument("--compact", action="store_true", help="Only calculate unmasked pixels")
+    parser.add_argument("--scratch", default="", help="Folder for memory mapped arrays")
+    parser.add_argument(
+        "--series",
+        action="store_true",
+        help="Write per-pixel statistics of one product over all scenes, instead of each scene",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Trace allocations for the peak memory of each stage, slows the run",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print progress of each scene")
+    args = parser.parse_args(argv)
+
+    if args.aggregate < 1:
+        parser.error("--aggregate takes a whole number of pixels, 1 or more")
+
+    scenes = listScenes(args)
+    if not (scenes):
+        parser.error("No scenes given")
+
+    resultStates = [(key in args.products, name) for key, name in engine.PRODUCTS]
+    settings = {
+        "blockSize": args.block_size,
+        "workers": args.workers,
+        "fused": args.fused,
+        "thermalTables": not (args.no_tables),
+        "pipeline": args.pipeline,
+        "virtual": args.virtual,
+        "scratch": args.scratch,
+        "compact": args.compact,
+        "profile": args.profile,
+        "multiband": args.multiband,
+        "aggregate": args.aggregate,
+        "precision": args.precision,
+        "crop": args.crop,
+        "cache": args.cache,
+        "cacheSize": args.cache_size,
+        "traceMemory": args.trace_memory,
+    }
+
+    if args.series:
+        if len(args.products) != 1:
+            parser.error("--series takes one product")
+        return processSeries(scenes, args, settings)
+
+    start = time.time()
+    failed = 0
+    for name, filePaths, satType in scenes:
+        if args.shape:
+            filePaths["Shape"] = args.shape
+        if args.output:
+            filePaths["output"] = os.path.join(args.output, name)
+            os.makedirs(filePaths["output"], exist_ok=True)
+
+        sceneStart = time.time()
+        error = processScene(filePaths, satType, resultStates, settings, args.verbose)
+        if error:
+            failed += 1
+            print("%s: failed - %s" % (name, error))
+        else:
+            print("%s: done in %.1f seconds" % (name, time.time() - sceneStart))
+
+    elapsed = time.time() - start
+    done = len(scenes) - failed
+    print(
+        "%d of %d scenes processed in %.1f seconds, %.1f scenes per hour"
+        % (done, len(scenes), elapsed, done * 3600 / elapsed if elapsed else 0)
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+Benchmarks of the plugin's stages on synthetic Landsat scenes
+
+Generates Landsat 5 and 8 bands, with MTL named archives, in a number of
+sizes, and times loading, masking, each calculation and saving, along with
+the resident memory each adds, or their traced peak with --trace-memory.
+Results are written as JSON, and can be compared with those of an earlier
+run. Needs numpy and GDAL, but not QGIS, as it runs the engine directly.
+Run from the folder containing the plugin, e.g.
+    python -m LandSurfaceTemperatureV3.benchmark --sizes 1024 2048 --output new.json
+    python -m LandSurfaceTemperatureV3.benchmark --compare old.json --output new.json
+"""
+
+import argparse, json, os, platform, shutil, sys, tarfile, tempfile, time
+import numpy as np
+
+## Band files and digital numbers of each satellite: (name, dtype, low, high)
+SYNTHETIC = {
+    "Landsat8": {
+        "prefix": "LC08_L1TP_144051_20200101_20200113_01_T1",
+        "bands": {
+            "Red": ("B4", np.uint16, 7000, 12000),
+            "Near-IR": ("B5", np.uint16, 6000, 25000),
+            "Thermal-IR": ("B10", np.uint16, 20000, 35000),
+        },
+    },
+    "Landsat5": {
+        "prefix": "LT05_L1TP_144051_20100101_20161016_01_T1",
+        "bands": {
+            "Red": ("B3", np.uint8, 20, 120),
+            "Near-IR": ("B4", np.uint8, 10, 150),
+            "Thermal-IR": ("B6", np.uint8, 100, 160),
+        },
+    },
+}
+
+CALCULATIONS = ["calc_TOA", "calc_BT", "calc_NDVI", "calc_PV", "calc_LSE", "calc_LST"]
+
+
+def syntheticBand(size, dtype, low, high, seed):
+
+    """
+    A spatially coherent band of digital numbers, with the tilted scene
+    outline of real Landsat tiles: corners outside it are 0
+    """
+
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    base = np.sin(7 * x + 3 * y) * np.cos(5 * y - 2 * x) * 0.5 + 0.5
+    noise = rng.normal(0, 0.02, (size, size)).astype(np.float32)
+    band = (low + (high - low) * np.clip(base + noise, 0, 1)).astype(dtype)
+    across = np.abs((x - 0.5) + 0.2 * (y - 0.5))
+    along = np.abs((y - 0.5) - 0.2 * (x - 0.5))
+    band[(across > 0.45) | (along > 0.45)] = 0
+    return band
+
+
+def writeScene(folder, satType, size, seed=0):
+
+    """
+    Writes the bands and MTL file of a synthetic scene into folder
+    Returns the paths of the files written, and a dict of band paths
+    """
+
+    import gdal, osr
+
+    utm = osr.SpatialReference()
+    utm.ImportFromEPSG(32644)
+    info = SYNTHETIC[satType]
+    written = []
+    bandPaths = dict()
+    gdalTypes = {np.uint8: gdal.GDT_Byte, np.uint16: gdal.GDT_UInt16}
+    for i, (band, (suffix, dtype, low, high)) in enumerate(sorted(info["bands"].items())):
+        path = os.path.join(folder, "%s_%s.TIF" % (info["prefix"], suffix))
+        data = syntheticBand(size, dtype, low, high, seed + i)
+        dataset = gdal.GetDriverByName("GTiff").Create(path, size, size, 1, gdalTypes[dtype])
+        dataset.SetGeoTransform((300000, 30, 0, 2500000, 0, -30))
+        dataset.SetProjection(utm.ExportToWkt())
+        dataset.GetRasterBand(1).WriteArray(data)
+        dataset = None
+        written.append(path)
+        bandPaths[band] = path
+
+    mtl = os.path.join(folder, info["prefix"] + "_MTL.txt")
+    with open(mtl, "w") as outfile:
+        outfile.write("GROUP = L1_METADATA_FILE\nEND_GROUP = L1_METADATA_FILE\nEND\n")
+    written.append(mtl)
+    return written, bandPaths
+
+
+def writeArchive(folder, satType, size, seed=0):
+
+    """
+    Writes a synthetic scene as a .tar.gz, named like a Landsat download
+    Returns its path
+    """
+
+    staging = tempfile.mkdtemp(dir=folder)
+    written, bandPaths = writeScene(staging, satType, size, seed)
+    path = os.path.join(folder, "%s_%d.tar.gz" % (SYNTHETIC[satType]["prefix"], size))
+    with tarfile.open(path, "w:gz") as archive:
+        for filepath in written:
+            archive.add(filepath, os.path.basename(filepath))
+    shutil.rmtree(staging)
+    return path
+
+
+def benchScene(archive, satType, size, args, work):
+
+    """
+    Runs one scene through the stages of the engine, measuring each
+    Returns a list of stage records, see instrument.stageRecorder
+    """
+
+    from . import batch, engine
+
+    parent = batch.consoleCarrier(verbose=False)
+    recorder = parent.recorder
+    names = dict(engine.PRODUCTS)
+    required = [(True, name) for key, name in engine.PRODUCTS]
+    settings = {
+        "virtual": args.virtual,
+        "profile": args.profile,
+        "precision": args.precision,
+        "thermalTables": not (args.no_tables),
+        "traceMemory": args.trace_memory,
+    }
+    outfolder = tempfile.mkdtemp(dir=work)
+
+    os.chdir(work)  ## Archives are extracted into the working folder
+    filePaths = {"zip": archive, "output": outfolder}
+    loader = engine.inputLoader(filePaths, required, None, parent, settings)
+    if not (loader.run()):  ## Recorded as the load stage
+        raise SystemExit("%s: %s" % (archive, loader.error))
+
+    proc = engine.sceneProcessor(loader, required, parent)
+    proc.bindInputs()
+    with recorder.stage("mask"):
+        r, nir, tir = proc.maskBands()
+
+    results = dict()
+    calc = engine.calculator(r, nir, tir, proc.sat_type, dtype=proc.dtype)
+    if args.fused:
+        with recorder.stage("computeFused"):
+            results, error = calc.computeFused(required, engine.workspace())
+    else:
+        for method in CALCULATIONS:
+            with recorder.stage(method):
+                error = getattr(calc, method)()
+            if error:
+                raise SystemExit("%s: %s" % (archive, error))
+        for key in names:
+            results[names[key]] = getattr(calc, key)
+
+    ## Every product, intermediates included, is in the precision asked for
+    wrong = [name for name in results if results[name].dtype != np.dtype(args.precision)]
+    if wrong:
+        raise SystemExit("%s: %s not %s" % (archive, ", ".join(wrong), args.precision))
+
+    with recorder.stage("save", profile=args.profile):
+        loader.filer.saveAll(results)
+
+    recorder.stop()
+    shutil.rmtree(outfolder)
+    for record in recorder.stages:
+        record.update(satellite=satType, size=size)
+    return recorder.stages
+
+
+def compare(previous, current):
+
+    """
+    Print each stage's wall time against that of an earlier run
+    """
+
+    before = dict()
+    for record in previous["stages"]:
+        before[(record["satellite"], record["size"], record["name"])] = record["wall"]
+
+    header = ("satellite", "size", "stage", "before", "now", "ratio")
+    print("%-10s %6s %-14s %10s %10s %8s" % header)
+    for record in current["stages"]:
+        key = (record["satellite"], record["size"], record["name"])
+        if key not in before:
+            continue
+        ratio = record["wall"] / before[key] if before[key] else float("nan")
+        print(
+            "%-10s %6d %-14s %9.3fs %9.3fs %7.2fx"
+            % (key + (before[key], record["wall"], ratio))
+        )
+
+
+def main(argv=None):
+
+    """
+    Entry point, see --help
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmark the plugin on synthetic scenes")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1024, 2048], help="Scene widths, 7800 for full"
+    )
+    parser.add_argument(
+        "--satellites", nargs="+", choices=list(SYNTHETIC), default=list(SYNTHETIC)
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scene, the fastest is kept")
+    parser.add_argument("--fused", action="store_true", help="Time the fused calculation instead")
+    parser.add_argument(
+        "--trace-memory", action="store_true", help="Trace allocations for peak memory, slower"
+    )
+    parser.add_argument(
+        "--no-tables", action="store_true", help="Calculate TOA and BT instead of looking them up"
+    )
+    parser.add_argument("--virtual", action="store_true", help="Read archives without extracting")
+    parser.add_argument(
+        "--profile", default="Plain", help="Output format, see fileio.OUTPUT_PROFILES"
+    )
+    parser.add_argument(
+        "--precision", choices=["float32", "float64"], default="float32", help="dtype of the calculations"
+    )
+    parser.add_argument("--output", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    import gdal
+
+    work = tempfile.mkdtemp(prefix="lst-benchmark-")
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output)
+    stages = []
+    try:
+        for satType in args.satellites:
+            for size in args.sizes:
+                archive = writeArchive(work, satType, size)
+                best = None
+                for i in range(args.repeat):
+                    records = benchScene(archive, satType, size, args, work)
+                    total = sum(record["wall"] for record in records)
+                    if best is None or total < best[0]:
+                        best = (total, records)
+                stages.extend(best[1])
+                print("%s %d: %.2f seconds" % (satType, size, best[0]))
+                os.remove(archive)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    current = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "gdal": gdal.__version__,
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "fused": args.fused,
+            "virtual": args.virtual,
+            "profile": args.profile,
+            "precision": args.precision,
+            "thermalTables": not (args.no_tables),
+            "traceMemory": args.trace_memory,
+        },
+        "stages": stages,
+    }
+    with open(output, "w") as outfile:
+        json.dump(current, outfile, indent=1)
+
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(json.load(infile), current)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import numpy as np
+import hashlib, json, os
+
+DEFAULT_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "LandSurfaceTemperature")
+
+## Run settings that change the values calculated, and so are part of keys
+KEYED_SETTINGS = ["fused", "crop", "precision"]
+
+
+class productCache(object):
+
+    """
+    On-disk store of calculated arrays, from one run to the next
+    Entries are keyed by a hash of everything their values depend on, and the
+    least recently used ones are deleted once the store grows past maxBytes
+    """
+
+    def __init__(self, folder, maxBytes):
+
+        self.folder = folder
+        self.maxBytes = maxBytes
+        if not (os.path.isdir(folder)):
+            os.makedirs(folder)
+
+    def fileIdentity(self, filepath):
+
+        """
+        Identifies a file by path, size and modification time
+        """
+
+        stat = os.stat(filepath)
+        return [os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns]
+
+    def contentIdentity(self, filepaths):
+
+        """
+        Identifies a set of files by a hash of their contents
+        """
+
+        digest = hashlib.sha1()
+        for filepath in filepaths:
+            digest.update(os.path.basename(filepath).encode("utf-8"))
+            with open(filepath, "rb") as infile:
+                for chunk in iter(lambda: infile.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def key(self, *parts):
+
+        """
+        Hash of any number of json serialisable parts
+        """
+
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def path(self, key, ftype):
+
+        return os.path.join(self.folder, key + "." + ftype)
+
+    def load(self, key):
+
+        """
+        Gets the array stored under key, memory mapped read only, or None
+        """
+
+        path = self.path(key, "npy")
+        if not (os.path.isfile(path)):
+            return None
+        os.utime(path)  ## Mark as recently used
+        return np.load(path, mmap_mode="r")
+
+    def loadInfo(self, key):
+
+        """
+        Gets the dict stored under key, or None
+        """
+
+        path = self.path(key, "json")
+        if not (os.path.isfile(path)):
+            return None
+        os.utime(path)
+        with open(path) as infile:
+            return json.load(infile)
+
+    def store(self, key, array):
+
+        """
+        Stores an array under key, then makes room if needed
+        """
+
+        part = self.path(key, "part.npy")
+        np.save(part, np.asarray(array))
+        os.replace(part, self.path(key, "npy"))
+        self.evict()
+
+    def storeInfo(self, key, info):
+
+        """
+        Stores a json serialisable dict under key
+        """
+
+        part = self.path(key, "part.json")
+        with open(part, "w") as outfile:
+            json.dump(info, outfile)
+        os.replace(part, self.path(key, "json"))
+
+    def evict(self):
+
+        """
+        Delete least recently used entries until the store fits in maxBytes
+        """
+
+        entries = []
+        for fname in os.listdir(self.folder):
+            if fname.endswith(".part.npy") or fname.endswith(".part.json"):
+                continue
+            stat = os.stat(os.path.join(self.folder, fname))
+            entries.append((stat.st_mtime, stat.st_size, fname))
+
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, fname in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, fname))
+            except OSError:
+                continue  ## In use, or removed by another run
+            total -= size
@@ -0,0 +1,1552 @@
+"""
+The calculations of the plugin, from input files to outputs, on numpy and
+GDAL alone. The QGIS tasks in mainLST and procedures are thin wrappers
+around inputLoader, sceneProcessor and outputSaver, and processScene runs
+all three without QGIS, e.g.
+    error = engine.processScene({"zip": "scene.tar.gz"}, None, resultStates, settings, parent)
+processSeries does the same for many scenes, keeping per-pixel statistics
+parent receives progress and errors, see batch.consoleCarrier
+"""
+
+import numpy as np
+import json, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import fileio, cache, instrument
+
+
+## Outputs, in the order of the required flags: short key and default name
+PRODUCTS = [
+    ("toa", "TOA Spectral Radiance"),
+    ("bt", "At Sensor Brightness Temperature"),
+    ("ndvi", "NDVI"),
+    ("pv", "Proportion of Vegetation"),
+    ("lse", "Land Surface Emissivity"),
+    ("lst", "Land Surface Temperature"),
+]
+
+## Constants used by the calculations, shared by every way of running them
+
+RADIANCE = {
+    "Landsat8": {
+        "mul": 0.0003342,
+        "add": -0.19,
+    },  ##-0.19 = 0.1 - 0.29 (landsat 8 band 10 correction)
+    "Landsat5": {"mul": 0.055375, "add": 1.18243},
+}
+THERMAL = {
+    "Landsat8": {"K1": 774.8853, "K2": 1321.0789},
+    "Landsat5": {"K1": 607.76, "K2": 1260.56},
+}
+VEGETATION = {"ndvi_soil": 0.2, "ndvi_vegetation": 0.5}
+EMISSIVITY = {
+    "water_emissivity": 0.991,
+    "soil_emissivity": 0.996,
+    "vegetation_emissivity": 0.973,
+}
+PLANCK = {"lambda": 0.00115, "rho": 1.4388}  ##Verify values, only ratio important
+
+## Products each product is calculated from
+DEPENDS = {
+    "toa": [],
+    "bt": ["toa"],
+    "ndvi": [],
+    "pv": ["ndvi"],
+    "lse": ["pv"],
+    "lst": ["bt", "lse"],
+}
+
+## dtypes the calculations can be run in, from bands read to outputs written,
+## chosen by the precision setting. Constants never change the dtype of a step
+PRECISIONS = ["float32", "float64"]
+
+
+def productConstants(key):
+
+    """
+    Every constant the values of product key depend on, including through
+    the products it is calculated from
+    """
+
+    own = {
+        "toa": RADIANCE,
+        "bt": THERMAL,
+        "ndvi": {},
+        "pv": VEGETATION,
+        "lse": EMISSIVITY,
+        "lst": PLANCK,
+    }
+    constants = {key: own[key]}
+    for dependency in DEPENDS[key]:
+        constants.update(productConstants(dependency))
+    return constants
+
+
+def planProducts(wanted):
+
+    """
+    Orders the calculations needed for the products in wanted (keys)
+    Returns a list of (key, release), release being the products that are
+    neither wanted nor needed by any later step, once key is calculated
+    """
+
+    needed = set()
+    stack = list(wanted)
+    while stack:
+        key = stack.pop()
+        if key not in needed:
+            needed.add(key)
+            stack.extend(DEPENDS[key])
+
+    ## PRODUCTS is in dependency order. PV comes out of the LSE pass, when
+    ## both are needed, rather than a pass of its own
+    steps = [
+        key for key, name in PRODUCTS
+        if key in needed and not (key == "pv" and "lse" in needed)
+    ]
+    plan = []
+    made = set()
+    for i, key in enumerate(steps):
+        made.add(key)
+        if key == "lse":
+            made.add("pv")
+        later = set()
+        for step in steps[i + 1 :]:
+            later.update(DEPENDS[step])
+            if step == "lse":
+                later.update(DEPENDS["pv"])
+        release = sorted(done for done in made if done not in wanted and done not in later)
+        made.difference_update(release)
+        plan.append((key, release))
+    return plan
+
+
+def planPeak(plan, pixels, inputs=3, itemsize=4):
+
+    """
+    Predicted peak of the memory held by a plan, in bytes, for a number of
+    pixels, counting the input bands and the products alive at once, all
+    of itemsize bytes per pixel
+    """
+
+    live = dict()
+    peak = inputs * itemsize * pixels
+    for key, release in plan:
+        live[key] = itemsize * pixels
+        if key == "lse" and "pv" not in live:
+            live["pv"] = itemsize * pixels
+        peak = max(peak, inputs * itemsize * pixels + sum(live.values()))
+        for done in release:
+            live.pop(done, None)
+    return peak
+
+
+def classifyVegetation(ndvi, pv=None, lse=None, chunk=1 << 16):
+
+    """
+    Calculates proportion of vegetation into pv and/or land surface
+    emissivity into lse, from ndvi, in a single pass
+    Each pixel's NDVI class is found once, without branching, and picks the
+    coefficients of
+        pv = pvConst + pvSlope * ((ndvi * scale) - offset) ** 2
+        lse = lseConst + lseSlope * pv
+    Pixels are worked on a chunk at a time, so that temporaries stay in cache
+    nan NDVI falls in class 0, and gives nan for both
+    """
+
+    data = VEGETATION
+    scale = data["ndvi_vegetation"] - data["ndvi_soil"]
+    offset = data["ndvi_soil"] / scale
+
+    ## Classes - water, soil, mixed, NDVI of exactly ndvi_vegetation, vegetation
+    bins = np.array([0, data["ndvi_soil"], data["ndvi_vegetation"], 0], ndvi.dtype)
+    bins[3] = np.nextafter(bins[2], bins.dtype.type(1))
+    pvConst = np.array([0, 0, 0, 0, 1], ndvi.dtype)
+    pvSlope = np.array([0, 0, 1, 1, 0], ndvi.dtype)
+
+    data = EMISSIVITY
+    water, soil, vegetation = (
+        data["water_emissivity"],
+        data["soil_emissivity"],
+        data["vegetation_emissivity"],
+    )
+    if lse is not None:
+        lseConst = np.array([water, soil, soil, vegetation, vegetation], lse.dtype)
+        lseSlope = np.array([0, 0, vegetation - soil, 0, 0], lse.dtype)
+
+    ndvi = ndvi.reshape(-1)
+    for start in range(0, ndvi.size, chunk):
+        part = ndvi[start : start + chunk]
+        index = (part >= bins[0]).view(np.uint8)
+        for limit in bins[1:]:
+            index += (part >= limit).view(np.uint8)
+
+        value = part * scale
+        value -= offset
+        np.square(value, out=value)
+        value *= pvSlope.take(index)
+        value += pvConst.take(index)
+        if pv is not None:
+            pv.reshape(-1)[start : start + chunk] = value
+
+        if lse is not None:
+            out = lse.reshape(-1)[start : start + chunk]
+            np.multiply(lseSlope.take(index), value, out=out)
+            out += lseConst.take(index)
+
+
+## Lookup tables of thermalTables, by satellite, dtype and table size
+TABLES = dict()
+
+
+def thermalTables(sat_type, dtype, size):
+
+    """
+    TOA and BT of every digital number below size, as arrays of dtype, with
+    the operations of calc_TOA and calc_BT, so that looking a band up in them
+    gives the same values, bit for bit. DN 0 is no data, and gives nan
+    """
+
+    key = (sat_type, np.dtype(dtype).str, size)
+    if key not in TABLES:
+        dn = np.arange(size, dtype=dtype)
+        data = RADIANCE[sat_type]
+        toa = (dn * data["mul"]) + data["add"]
+        data = THERMAL[sat_type]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bt = (data["K2"] / np.log((data["K1"] / toa) + 1)) - 273.15
+        toa[0] = np.nan
+        bt[0] = np.nan
+        TABLES[key] = (toa, bt)
+    return TABLES[key]
+
+
+def lookUp(table, dn, out, chunk=1 << 16):
+
+    """
+    Fills out with the values of table at each digital number of dn
+    Done a chunk at a time, so that indices stay in cache
+    """
+
+    dn = dn.reshape(-1)
+    flat = out.reshape(-1)
+    for start in range(0, dn.size, chunk):
+        np.take(table, dn[start : start + chunk], out=flat[start : start + chunk])
+
+
+def aggregateMean(array, factor, chunkRows=1024):
+
+    """
+    Mean of each factor by factor square of a 2-D array, ignoring nan, as an
+    array of its dtype on the coarser grid, nan where a square has no values
+    Squares on the right and bottom edges may be partial
+    Done about chunkRows input rows at a time, to bound temporaries, and
+    summed in float64
+    """
+
+    rows, cols = array.shape
+    out = np.empty((-(-rows // factor), -(-cols // factor)), array.dtype)
+    whole = cols - cols % factor  ## Columns of whole squares
+    step = max(1, chunkRows // factor)  ## Output rows per chunk
+    for start in range(0, out.shape[0], step):
+        block = array[start * factor : (start + step) * factor]
+        count = -(-block.shape[0] // factor)
+        if block.shape[0] < count * factor:  ## Only the last row of squares
+            padded = np.full((count * factor, cols), np.nan, array.dtype)
+            padded[: block.shape[0]] = block
+            block = padded
+
+        parts = [(block[:, :whole], 0, whole // factor)] if whole else []
+        if whole < cols:  ## The partial squares of the right edge
+            parts.append((block[:, whole:], whole // factor, 1))
+        for part, left, across in parts:
+            squares = part.reshape(count, factor, across, -1)
+            total = np.nansum(squares, axis=(1, 3), dtype=np.float64)
+            valid = np.count_nonzero(~np.isnan(squares), axis=(1, 3))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out[start : start + count, left : left + across] = total / valid
+    return out
+
+
+class workspace(object):
+
+    """
+    Pool of named arrays, kept to be reused instead of allocating new ones
+    If scratch is a folder, arrays are memory mapped files in it, so that
+    the page cache can hold them instead of RAM
+    """
+
+    def __init__(self, scratch=""):
+
+        self.arrays = dict()
+        self.files = dict()
+        self.scratch = scratch
+
+    def get(self, name, shape, dtype=np.float32):
+
+        """
+        Returns the array called name, allocated only if shape or dtype changed
+        Contents are whatever the last user left in it
+        """
+
+        array = self.arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = self.allocate(name, shape, dtype)
+            self.arrays[name] = array
+        return array
+
+    def allocate(self, name, shape, dtype):
+
+        """
+        Create a new array, in memory or in the scratch folder
+        Scratch files have no name, they are deleted once closed
+        """
+
+        if not (self.scratch):
+            return np.empty(shape, dtype)
+        if name in self.files:
+            self.files[name].close()
+        self.files[name] = tempfile.TemporaryFile(dir=self.scratch)
+        return np.memmap(self.files[name], dtype, "w+", shape=shape)
+
+    def release(self, name):
+
+        """
+        Drop the array called name, and delete its scratch file
+        """
+
+        self.arrays.pop(name, None)
+        if name in self.files:
+            self.files.pop(name).close()
+
+    def clear(self):
+
+        """
+        Drop all arrays, and delete their scratch files
+        """
+
+        self.arrays = dict()
+        for name in self.files:
+            self.files[name].close()
+        self.files = dict()
+
+
+class calculator(object):
+
+    """
+    Derives outputs from the input bands of a scene, or of a block of one
+    """
+
+    def __init__(self, r, nir, tir, sat_type, progress=None, space=None, dtype=np.float32):
+
+        """
+        Initializes all numpy arrays
+        progress, if given, is called with the steps done, out of how many,
+        and a message
+        space, if given a workspace with a scratch folder, holds the results
+        dtype, see PRECISIONS, is that of every product. Bands of another
+        dtype are converted to it, except a Thermal-IR band of digital
+        numbers, in one of fileio.RAW_DTYPES, see thermalTables
+        """
+
+        self.dtype = np.dtype(dtype)
+        self.r = r.astype(self.dtype, copy=False)
+        self.nir = nir.astype(self.dtype, copy=False)
+        if tir.dtype not in fileio.RAW_DTYPES:
+            tir = tir.astype(self.dtype, copy=False)
+        self.tir = tir
+        self.sat_type = sat_type
+        self.progress = progress
+        self.space = space
+
+        self.toa = np.array([])
+        self.bt = np.array([])
+        self.ndvi = np.array([])
+        self.pv = np.array([])
+        self.lse = np.array([])
+        self.lst = np.array([])
+
+    def updateProgress(self, done, total, text):
+
+        """
+        Forward progress updates, if anyone is listening
+        """
+
+        if self.progress:
+            self.progress(done, total, text)
+
+    def allocate(self, name, shape, dtype):
+
+        """
+        Creates an array for a result, in the scratch folder if there is one
+        """
+
+        if not (self.space and self.space.scratch):
+            return np.empty(shape, dtype)
+        return self.space.get(name, shape, dtype)
+
+    def keep(self, name, array):
+
+        """
+        Moves a result to the scratch folder of the workspace, if there is one
+        Results are held in dtype, whatever their steps gave
+        """
+
+        if not (self.space and self.space.scratch):
+            return array.astype(self.dtype, copy=False)
+        stored = self.space.get(name, array.shape, self.dtype)
+        stored[...] = array
+        return stored
+
+    def tables(self):
+
+        """
+        TOA and BT lookup tables for the Thermal-IR band, if it holds digital
+        numbers, or None, see thermalTables
+        """
+
+        if self.tir.dtype not in fileio.RAW_DTYPES:
+            return None
+        size = np.iinfo(self.tir.dtype).max + 1
+        return thermalTables(self.sat_type, self.dtype, size)
+
+    def calc_TOA(self):
+
+        """
+        Calculates Top Of Atmosphere Radiance
+        """
+
+        if self.toa.size:
+            return
+        if not (self.tir.size):
+            return "Thermal-IR data missing"
+
+        tables = self.tables()
+        if tables:
+            self.toa = self.allocate("toa", self.tir.shape, self.dtype)
+            lookUp(tables[0], self.tir, self.toa)
+            return
+
+        data = RADIANCE
+        self.toa = self.keep(
+            "toa", (self.tir * data[self.sat_type]["mul"]) + data[self.sat_type]["add"]
+        )
+
+    def calc_BT(self):
+
+        """
+        Calculates at-sensor Brightness Temperature
+        """
+
+        if self.bt.size:
+            return
+
+        tables = self.tables()
+        if tables and self.tir.size:  ## Straight from the digital numbers
+            self.bt = self.allocate("bt", self.tir.shape, self.dtype)
+            lookUp(tables[1], self.tir, self.bt)
+            return
+
+        error = self.calc_TOA()
+        if error:
+            return error
+
+        data = THERMAL
+        self.bt = self.keep(
+            "bt",
+            (
+                data[self.sat_type]["K2"]
+                / np.log((data[self.sat_type]["K1"] / self.toa) + 1)
+            )
+            - 273.15,
+        )
+
+    def calc_NDVI(self):
+
+        """
+        Calculates NDVI values (Normalized Difference Vegetation Index)
+        """
+
+        if self.ndvi.size:
+            return
+
+        if not (self.nir.size) and not (self.r.size):
+            return "Red and Near-IR data missing"
+        if not (self.nir.size):
+            return "Near-IR data missing"
+        if not (self.r.size):
+            return "Red data missing"
+        
+        self.ndvi = self.keep("ndvi", (self.nir - self.r) / (self.nir + self.r))
+
+    def calc_PV(self):
+
+        """
+        Calculates proportion of vegetation
+        """
+
+        if self.pv.size:
+            return
+
+        error = self.calc_NDVI()
+        if error:
+            return error
+        
+        self.pv = self.allocate("pv", self.ndvi.shape, self.dtype)
+        classifyVegetation(self.ndvi, self.pv)
+
+    def calc_LSE(self):
+
+        """
+        Calculates Land Surface Emmissivity
+        """
+
+        if self.lse.size:
+            return
+        error = self.calc_NDVI()
+        if error:
+            return error
+        
+        ## PV comes out of the same pass, unless it is already there
+        self.lse = self.allocate("lse", self.ndvi.shape, self.dtype)
+        if self.pv.size:
+            classifyVegetation(self.ndvi, None, self.lse)
+        else:
+            self.pv = self.allocate("pv", self.ndvi.shape, self.dtype)
+            classifyVegetation(self.ndvi, self.pv, self.lse)
+
+    def calc_LST(self):
+
+        """
+        Calculates Land Surface Temperature
+        """
+
+        if self.lst.size:
+            return
+        error = self.calc_BT()
+        if error:
+            return error
+        error = self.calc_LSE()
+        if error:
+            return error
+        
+        data = PLANCK
+        self.lst = self.keep(
+            "lst",
+            self.bt / (1 + (data["lambda"] * self.bt / data["rho"]) * np.log(self.lse)),
+        )
+
+    def compute(self, required):
+
+        """
+        Calculates every output flagged in required, following planProducts
+        Intermediates are let go of as soon as nothing left needs them
+        Returns a dict of arrays keyed by output name, and an error if any
+        """
+
+        names = dict()
+        for res, (key, default) in zip(required, PRODUCTS):
+            if res[0]:
+                names[key] = res[1]
+
+        plan = planProducts(list(names))
+        ## BT looked up from digital numbers does not need TOA, see thermalTables
+        lookedUp = "toa" not in names and self.tables() is not None
+        for i, (key, release) in enumerate(plan):
+            error = None if key == "toa" and lookedUp else getattr(self, "calc_" + key.upper())()
+            if error:
+                return dict(), error
+            for done in release:
+                setattr(self, done, np.array([]))
+                if self.space:  ## Scratch copies go too, see keep
+                    self.space.release(done)
+            self.updateProgress(i + 1, len(plan), "Calculated " + key.upper())
+
+        results = dict()
+        for key in names:
+            results[names[key]] = getattr(self, key)
+        return results, None
+
+    def checkBands(self, thermal, vegetation):
+
+        """
+        Error message if the bands needed for the thermal and/or vegetation
+        outputs are missing
+        """
+
+        if thermal and not (self.tir.size):
+            return "Thermal-IR data missing"
+        if vegetation:
+            if not (self.nir.size) and not (self.r.size):
+                return "Red and Near-IR data missing"
+            if not (self.nir.size):
+                return "Near-IR data missing"
+            if not (self.r.size):
+                return "Red data missing"
+
+    def computeFused(self, required, space):
+
+        """
+        Calculates every output flagged in required, like compute, in one pass
+        Every step is an in-place ufunc on a buffer from space (a workspace),
+        so buffers are reused from one call to the next instead of allocated.
+        Intermediates that were not asked for share buffers with the next step,
+        and are overwritten.
+        Returns a dict of arrays keyed by output name, and an error if any
+        """
+
+        results = dict()
+        toa, bt, ndvi, pv, lse, lst = [res for res in required]
+
+        thermal = toa[0] or bt[0] or lst[0]
+        vegetation = ndvi[0] or pv[0] or lse[0] or lst[0]
+        error = self.checkBands(thermal, vegetation)
+        if error:
+            return results, error
+
+        band = self.tir if thermal else self.r
+        shape, dtype = band.shape, self.dtype
+
+        ## Digital numbers are looked up instead, see thermalTables
+        tables = self.tables() if thermal else None
+
+        if thermal:
+            data = RADIANCE[self.sat_type]
+            toaBuf = space.get("toa", shape, dtype)
+            if not (tables):
+                np.multiply(self.tir, data["mul"], out=toaBuf)
+                toaBuf += data["add"]
+            elif toa[0]:
+                lookUp(tables[0], self.tir, toaBuf)
+            if toa[0]:
+                results[toa[1]] = toaBuf
+
+        if bt[0] or lst[0]:
+            data = THERMAL[self.sat_type]
+            btBuf = space.get("bt", shape, dtype) if toa[0] else toaBuf
+            if tables:
+                lookUp(tables[1], self.tir, btBuf)
+            else:
+                np.divide(data["K1"], toaBuf, out=btBuf)
+                btBuf += 1
+                np.log(btBuf, out=btBuf)
+                np.divide(data["K2"], btBuf, out=btBuf)
+                btBuf -= 273.15
+            if bt[0]:
+                results[bt[1]] = btBuf
+
+        self.updateProgress(1, 3, "Calculated TOA and BT")
+
+        if vegetation:
+            ndviBuf = space.get("ndvi", shape, dtype)
+            tmpBuf = space.get("tmp", shape, dtype)
+            np.subtract(self.nir, self.r, out=ndviBuf)
+            np.add(self.nir, self.r, out=tmpBuf)
+            ndviBuf /= tmpBuf
+            if ndvi[0]:
+                results[ndvi[1]] = ndviBuf
+
+        self.updateProgress(2, 3, "Calculated NDVI")
+
+        if pv[0] or lse[0] or lst[0]:
+            pvBuf = space.get("pv", shape, dtype) if pv[0] else None
+            lseBuf = space.get("lse", shape, dtype) if lse[0] or lst[0] else None
+            classifyVegetation(ndviBuf, pvBuf, lseBuf)
+            if pv[0]:
+                results[pv[1]] = pvBuf
+            if lse[0]:
+                results[lse[1]] = lseBuf
+
+        if lst[0]:
+            data = PLANCK
+            lstBuf = space.get("lst", shape, dtype) if lse[0] else lseBuf
+            np.log(lseBuf, out=lstBuf)
+            np.multiply(btBuf, data["lambda"], out=tmpBuf)
+            tmpBuf /= data["rho"]
+            tmpBuf *= lstBuf
+            tmpBuf += 1
+            np.divide(btBuf, tmpBuf, out=lstBuf)
+            results[lst[1]] = lstBuf
+
+        self.updateProgress(3, 3, "Calculated PV, LSE and LST")
+        return results, error
+
+
+class sceneProcessor(object):
+
+    """
+    Called for numpy array manipulation
+    """
+
+    def __init__(self, input_object, required, parent, isCanceled=None):
+
+        """
+        Initializes all numpy arrays
+        input_object is the inputLoader of the scene, isCanceled, if given,
+        is called between blocks to check whether to stop
+        """
+
+        self.isCanceled = isCanceled or (lambda: False)
+        self.input_object = input_object
+        self.required = required
+        self.parent = parent
+
+        self.r = np.array([])
+        self.nir = np.array([])
+        self.tir = np.array([])
+
+        self.error = None
+        self.results = dict()
+        self.space = workspace()
+        self.pool = None
+        self.compacted = None  ## Mask to scatter compacted results with
+        self.plannedPeak = 0  ## Predicted peak bytes of the calculations
+        self.dtype = np.dtype(np.float32)  ## Of the calculations, see PRECISIONS
+
+    def getBand(self, bandName):
+
+        """
+        Gets individual bands for dict of bands
+        Masks '0' values with numpy nan, or 0 (no data) in bands of digital
+        numbers, see thermalTables
+        """
+
+        if bandName in self.bands:
+            band = self.bands[bandName]
+            band[np.logical_not(self.mask)] = np.nan if band.dtype.kind == "f" else 0
+            return band
+        else:
+            return np.array([])
+
+    def maskedBands(self):
+
+        """
+        Gets the Red, Near-IR and Thermal-IR bands, masked by getBand
+        With the compact setting, gets only their valid pixels instead, as
+        1-D arrays, so that masked pixels are never calculated
+        """
+
+        names = ("Red", "Near-IR", "Thermal-IR")
+        if not (self.settings.get("compact")):
+            return [self.getBand(name) for name in names]
+        return [
+            self.bands[name][self.mask] if name in self.bands else np.array([])
+            for name in names
+        ]
+
+    def prepareMask(self, bands, space=None):
+
+        """
+        Builds the mask of pixels to be calculated from a dict of bands
+        Pixels outside the shapefile, or '0' in any band, are left out
+        Removes the shapefile from bands, it is not needed afterwards
+        The mask is kept in space (a workspace), if given
+        """
+
+        shape = np.array([])
+        if "Shape" in bands:
+            shape = bands["Shape"]
+            del bands["Shape"]
+
+        tempshape = list(bands.values())[0].shape
+        if space:
+            mask = space.get("mask", tempshape, bool)
+            mask[...] = True
+        else:
+            mask = np.full(tempshape, True)
+        if shape.size:
+            mask[shape == 1] = False
+        for layer in list(bands.values()):
+            mask[layer == 0] = False
+        return mask
+
+    def reportPlan(self, pixels):
+
+        """
+        Report the calculations planned for the requested products, and the
+        memory they are predicted to hold at most, for a number of pixels
+        """
+
+        keys = [key for res, (key, default) in zip(self.required, PRODUCTS) if res[0]]
+        plan = planProducts(keys)
+        self.plannedPeak = planPeak(plan, pixels, itemsize=self.dtype.itemsize)
+        self.parent.meter.step(
+            "calculate",
+            0,
+            1,
+            "Calculating %s, predicted peak memory %d MB"
+            % (", ".join(key for key, release in plan), self.plannedPeak >> 20),
+        )
+
+    def computeBlock(self, calc, space):
+
+        """
+        Runs the calculations on a calculator, as chosen by the settings
+        space is the workspace used for fused calculations
+        """
+
+        if self.settings.get("fused"):
+            return calc.computeFused(self.required, space)
+        return calc.compute(self.required)
+
+    def calculate(self, r, nir, tir, space, progress=None, seed=None):
+
+        """
+        Runs the calculations on whole bands (a scene or a block)
+        Split into row strips over the worker pool, if there is one
+        progress, if given, is called with the steps (or strips) done, out
+        of how many, and a message
+        seed, a dict of arrays keyed by product, are taken as already
+        calculated by the per-step calculations, without a pool
+        Returns a dict of arrays keyed by output name, and an error if any
+        """
+
+        if not (self.pool):
+            calc = calculator(r, nir, tir, self.sat_type, progress, space, self.dtype)
+            if seed and not (self.settings.get("fused")):
+                for key in seed:
+                    setattr(calc, key, np.asarray(seed[key]))
+            return self.computeBlock(calc, space)
+
+        rows = max(band.shape[0] for band in (r, nir, tir))
+        strips = self.settings["workers"] * 4
+        stripRows = max(1, -(-rows // strips))
+
+        outputs = dict()
+        local = threading.local()
+        lock = threading.Lock()
+
+        def computeStrip(start):
+
+            stop = start + stripRows
+            calc = calculator(
+                r[start:stop], nir[start:stop], tir[start:stop], self.sat_type, dtype=self.dtype
+            )
+            if not (hasattr(local, "space")):
+                local.space = workspace()
+            results, error = self.computeBlock(calc, local.space)
+            for name in results:
+                with lock:
+                    if name not in outputs:
+                        shape = (rows,) + results[name].shape[1:]
+                        outputs[name] = space.get(
+                            "output " + name, shape, results[name].dtype
+                        )
+                outputs[name][start:stop] = results[name]
+            if progress:
+                with lock:
+                    finished.append(start)
+                    progress(len(finished), len(starts), "Calculated %d row strips" % len(finished))
+            return error
+
+        starts = range(0, rows, stripRows)
+        finished = []
+        errors = list(self.pool.map(computeStrip, starts))
+        return outputs, next((error for error in errors if error), None)
+
+    def run(self):
+
+        """
+        Only this function should be accessed from outside this file
+        Inputs:
+            bands - dict of numpy arrays, "Red", "Near-IR", "Thermal-IR" are the relevant keys
+            sat_type - either "Landsat8" or "Landsat5"
+            required - array of tuples of length 6, contains boolean and the name associated with layer in tuple
+                        [toa, bt, ndvi, pv, lse, lst] in order.
+            settings - dict of optional run settings, see form.MainWindow
+            form - user interfacing element
+        Measured as the calculate stage of the run
+        """
+
+        filer = self.input_object.filer
+        with self.parent.recorder.stage("calculate") as record:
+            read, written = filer.bytesRead, filer.bytesWritten
+            result = self.runTask()
+            record["bytesRead"] = filer.bytesRead - read
+            record["bytesWritten"] = filer.bytesWritten - written
+        return result
+
+    def bindInputs(self):
+
+        """
+        Take the bands, satellite, file handler and settings of the
+        inputLoader, and the precision its settings ask for
+        """
+
+        self.bands = self.input_object.bands
+        self.sat_type = self.input_object.satType
+        self.filer = self.input_object.filer
+        self.settings = self.input_object.settings
+        self.dtype = np.dtype(self.settings.get("precision", "float32"))
+
+    def maskBands(self, space=None):
+
+        """
+        Builds the mask of the bound bands, see prepareMask, and returns
+        them masked with it, see maskedBands
+        """
+
+        self.mask = self.prepareMask(self.bands, space)
+        return self.maskedBands()
+
+    def runTask(self):
+
+        """
+        Runs the calculations as the settings say, see run
+        """
+
+        self.bindInputs()
+        self.space = workspace(self.settings.get("scratch", ""))
+
+        if self.settings.get("workers", 1) > 1:
+            self.pool = ThreadPoolExecutor(self.settings["workers"])
+        try:
+            if self.settings.get("blockSize"):
+                result = self.runWindowed()
+            else:
+                result = self.runScene()
+            ## Failing stops the tasks after this one
+            return result and not (self.error)
+        finally:
+            if self.pool:
+                self.pool.shutdown()
+                self.pool = None
+
+    def runScene(self):
+
+        """
+        Calculates the whole scene at once, results are saved by postprocess
+        Outputs found in the cache are reused, and new ones stored in it
+        """
+
+        cached = self.input_object.cached
+        wanted = [
+            (res[1], key) for res, (key, default) in zip(self.required, PRODUCTS) if res[0]
+        ]
+        if cached and all(key in cached for name, key in wanted):
+            for name, key in wanted:
+                self.results[name] = cached[key]
+            self.aggregateResults()
+            self.parent.meter.step("calculate", 1, 1, "Outputs taken from cache, saving outputs")
+            return True
+
+        meter = self.parent.meter
+        meter.step("calculate", 0, 1, "Preparing mask from unknown areas and shapefile")
+
+        if not (list(self.bands.values())):
+            self.error = "Files missing"
+            return True
+
+        self.mask = self.prepareMask(self.bands, self.space)
+
+        if(not(np.any(self.mask))):
+            self.error = "Entire image masked - please check shapefile"
+            return True
+        
+        meter.step("calculate", 0, 1, "Masking input bands")
+
+        self.r, self.nir, self.tir = self.maskedBands()
+        if self.settings.get("compact"):
+            self.compacted = self.mask
+
+        self.reportPlan(self.r.size or self.mask.size)
+
+        ## Calculations count for all but the last tenth of the stage
+        progress = lambda done, total, text: meter.step("calculate", 0.9 * done, total, text)
+        self.results, self.error = self.calculate(
+            self.r, self.nir, self.tir, self.space, progress, cached
+        )
+
+        productCache = self.input_object.cache
+        if productCache and not (self.error or self.compacted is not None):
+            meter.step("calculate", 0.9, 1, "Storing outputs in cache")
+            for name, key in wanted:
+                if key not in cached:
+                    productCache.store(self.input_object.cacheKey(key), self.results[name])
+            productCache.storeInfo(self.input_object.cacheKey("grid"), self.filer.gridInfo())
+
+        if not (self.error):
+            self.aggregateResults()
+        meter.step("calculate", 1, 1, "Finished calculations, saving outputs")
+        return True
+
+    def aggregateResults(self):
+
+        """
+        With the aggregate setting, replace the results by their means over
+        squares of that many pixels a side, see aggregateMean, so that full
+        resolution outputs are never written
+        The cache is given full resolution results, before this
+        """
+
+        factor = self.settings.get("aggregate", 1)
+        if factor <= 1:
+            return
+        for name in self.results:
+            array = self.results[name]
+            if self.compacted is not None:
+                array = self.filer.expand(array, self.compacted)
+            self.results[name] = aggregateMean(array, factor)
+        self.compacted = None
+
+    def runWindowed(self):
+
+        """
+        Streams the scene through the calculations, one block of rows at a time
+        Each block is read from every band, calculated, and written straight
+        into outputs created beforehand, so only one block is held in memory
+        With the pipeline setting, reading and writing overlap the calculations
+        With the aggregate setting, blocks are a whole number of output rows
+        """
+
+        factor = self.settings.get("aggregate", 1)
+        blockSize = -(-self.settings["blockSize"] // factor) * factor
+        rows, cols = self.filer.rows, self.filer.cols
+
+        if not (self.filer.sources):
+            self.error = "Files missing"
+            return True
+
+        names = [res[1] for res in self.required if res[0]]
+        self.filer.createOutputs(names)
+
+        self.reportPlan(min(blockSize, rows) * cols)
+        blocks = [(yoff, min(blockSize, rows - yoff)) for yoff in range(0, rows, blockSize)]
+        try:
+            if self.settings.get("pipeline"):
+                anyValid = self.runPipelined(blocks, names)
+            else:
+                anyValid = False
+                space = workspace()
+                for yoff, ysize in blocks:
+                    if self.isCanceled():
+                        return False
+                    bands = self.filer.readWindow(yoff, ysize)
+                    results, scatter, valid = self.calculateBlock(bands, names, space)
+                    if self.error:
+                        return True
+                    anyValid = anyValid or valid
+                    self.writeBlock(yoff, ysize, results, scatter)
+        finally:
+            self.filer.closeInputs()
+            self.filer.closeOutputs()
+
+        if self.isCanceled():
+            return False
+        if not (anyValid or self.error):
+            self.error = "Entire image masked - please check shapefile"
+        return True
+
+    def runPipelined(self, blocks, names):
+
+        """
+        The block loop of runWindowed, as three overlapping stages: a reader
+        and a writer thread, each one block away from the calculations, so
+        that block N+1 is read while N is calculated and N-1 written
+        Two workspaces take turns, the one of the block being written is
+        never calculated into
+        Returns whether any block had valid pixels
+        """
+
+        reader = ThreadPoolExecutor(1)
+        writer = ThreadPoolExecutor(1)
+        spaces = [workspace(), workspace()]
+        anyValid = False
+        writing = None
+        try:
+            reading = reader.submit(self.filer.readWindow, *blocks[0])
+            for i, (yoff, ysize) in enumerate(blocks):
+                bands = reading.result()
+                if i + 1 < len(blocks):
+                    reading = reader.submit(self.filer.readWindow, *blocks[i + 1])
+                if self.isCanceled():
+                    break
+
+                results, scatter, valid = self.calculateBlock(bands, names, spaces[i % 2])
+                if self.error:
+                    break
+                anyValid = anyValid or valid
+
+                if writing:
+                    writing.result()  ## At most one block waits to be written
+                writing = writer.submit(self.writeBlock, yoff, ysize, results, scatter)
+            if writing:
+                writing.result()
+        finally:
+            reader.shutdown()
+            writer.shutdown()
+        return anyValid
+
+    def calculateBlock(self, bands, names, space):
+
+        """
+        Calculates a block of rows, read by readWindow, in space (a workspace)
+        Returns its results, the mask to scatter them with if compacted,
+        and whether it had any valid pixels
+        """
+
+        self.bands = bands
+        self.mask = self.prepareMask(self.bands)
+        if not (np.any(self.mask)):
+            results = dict()
+            for name in names:
+                results[name] = np.full(self.mask.shape, np.nan, self.dtype)
+            return results, None, False
+
+        r, nir, tir = self.maskedBands()
+        results, self.error = self.calculate(r, nir, tir, space)
+        scatter = self.mask if self.settings.get("compact") else None
+        return results, scatter, True
+
+    def writeBlock(self, yoff, ysize, results, scatter=None):
+
+        """
+        Writes the results of a block of rows into the outputs, and reports
+        With the aggregate setting, only their means are written, see aggregateMean
+        """
+
+        factor = self.settings.get("aggregate", 1)
+        for name in results:
+            if factor > 1:
+                array = results[name]
+                if scatter is not None:
+                    array = self.filer.expand(array, scatter)
+                self.filer.saveResult(name, aggregateMean(array, factor), yoff // factor)
+            else:
+                self.filer.saveResult(name, results[name], yoff, scatter)
+        text = "Calculated rows %d to %d" % (yoff, yoff + ysize)
+        self.parent.meter.step("calculate", yoff + ysize, self.filer.rows, text)
+
+
+class inputLoader(object):
+
+    """
+    Obtains data from files
+    """
+
+    def __init__(self, filePaths, resultStates, satType, parent, settings=None):
+
+        self.filePaths = filePaths
+        self.resultStates = resultStates
+        self.satType = satType
+        self.parent = parent
+        self.settings = settings or dict()
+
+        self.bands = dict()
+        self.filer = None
+        self.error = None
+
+        self.cache = None
+        self.cached = dict()  ## Arrays found in the cache, by product
+
+    def cacheKey(self, product):
+
+        """
+        Cache key of a product ("grid" for the grid info) of these inputs
+        """
+
+        inputs = dict()
+        for name in self.filePaths:
+            inputs[name] = self.cache.fileIdentity(self.filePaths[name])
+        ## An archive decides its own satellite type
+        satType = None if "zip" in self.filePaths else self.satType
+        constants = productConstants(product) if product != "grid" else {}
+        settings = [self.settings.get(name) for name in cache.KEYED_SETTINGS]
+        return self.cache.key(product, inputs, satType, constants, settings)
+
+    def loadCached(self):
+
+        """
+        Look for this run's outputs in the cache
+        Returns True if all of them were found, so that inputs need not be read
+        """
+
+        wanted = []
+        for (required, name), (key, default) in zip(self.resultStates, PRODUCTS):
+            array = self.cache.load(self.cacheKey(key))
+            if array is not None:
+                self.cached[key] = array
+            if required:
+                wanted.append(key)
+
+        info = self.cache.loadInfo(self.cacheKey("grid"))
+        if not (info) or not (all(key in self.cached for key in wanted)):
+            return False
+        self.filer.setGridInfo(info)
+        return True
+
+    def run(self):
+
+        """
+        Main processing element, called every time Go is pressed
+        Measured as the load stage of the run
+        """
+
+        self.parent.recorder.start(self.settings.get("traceMemory", False))
+        with self.parent.recorder.stage("load") as record:
+            result = self.loadInputs()
+            record["bytesRead"] = self.filer.bytesRead
+        return result
+
+    def loadInputs(self):
+
+        """
+        Reads the input bands, or only locates them for windowed runs
+        """
+
+        self.filer = fileio.fileHandler()
+        self.filer.profile = self.settings.get("profile", "Plain")
+        self.filer.multiband = self.settings.get("multiband", False)
+        self.filer.crop = self.settings.get("crop", False)
+        self.filer.aggregate = max(1, self.settings.get("aggregate", 1))
+        self.filer.precision = self.settings.get("precision", "float32")
+        if self.settings.get("thermalTables", True):
+            self.filer.raw = ["Thermal-IR"]
+        for (required, name), (key, default) in zip(self.resultStates, PRODUCTS):
+            if required:
+                self.filer.kinds[name] = key
+        meter = self.parent.meter
+        meter.step("load", 0, 1, "Starting, setting optional out folder")
+
+        if("output" in self.filePaths):
+            self.filer.prepareOutFolder(self.filePaths["output"])
+            del self.filePaths["output"]
+        
+        if self.settings.get("cache"):
+            self.cache = cache.productCache(
+                self.settings.get("cacheFolder") or cache.DEFAULT_FOLDER,
+                int(self.settings.get("cacheSize", 10) * 2 ** 30),
+            )
+            self.filer.cache = self.cache  ## For rasterized shapefiles
+
+        ## Whole scene runs can reuse outputs from earlier ones
+        if self.cache and not (
+            self.settings.get("blockSize") or self.settings.get("compact")
+        ):
+            if self.loadCached():
+                meter.step("load", 1, 1, "All outputs found in cache")
+                return True
+
+        meter.step("load", 0, 1, "Loading files")
+
+        ## Windowed runs read blocks later, only locate the bands here
+        readData = not (self.settings.get("blockSize"))
+        total = 3 if "zip" in self.filePaths else len(self.filePaths) - ("Shape" in self.filePaths)
+        read = []
+
+        def onRead(filepath):
+            read.append(filepath)
+            meter.step("load", len(read), total, "Read " + filepath[filepath.rfind("/") + 1 :])
+
+        self.filer.onRead = onRead
+
+        if "zip" in self.filePaths:
+            self.bands = self.filer.loadZip(
+                self.filePaths, readData, self.settings.get("virtual")
+            )
+            self.satType = self.bands["sat_type"]
+            del self.bands["sat_type"]
+        else:
+            self.bands = self.filer.loadBands(self.filePaths, readData)
+        
+        meter.step("load", 1, 1, "Files ready, checking for errors")
+
+        if self.bands["Error"]:
+            self.error = self.bands["Error"]
+            return False
+        del self.bands["Error"]
+        return True
+
+
+class outputSaver(object):
+
+    """
+    Saves outputs, and the run report
+    """
+
+    def __init__(self, proc_object, parent):
+
+        self.proc_object = proc_object
+        self.parent = parent
+        self.error = None
+    
+    def run(self):
+
+        """
+        Main processing element, called when calculations are complete
+        Measured as the save stage of the run, and ends with the run report
+        """
+
+        self.filer = self.proc_object.filer
+        meter = self.parent.meter
+        results = self.proc_object.results
+        saved = []
+
+        def onWrite(name):
+            saved.append(name)
+            meter.step("save", len(saved), len(results), "Saved " + name)
+
+        recorder = self.parent.recorder
+        with recorder.stage("save") as record:
+            written = self.filer.bytesWritten
+            meter.step("save", 0, 1, "Saving outputs")
+            self.filer.onWrite = onWrite
+            self.filer.saveAll(results, self.proc_object.compacted)
+            self.proc_object.results = dict()
+            self.proc_object.space.clear()
+            record["bytesWritten"] = self.filer.bytesWritten - written
+        recorder.stop()
+
+        self.writeReport()
+        instrument.workMeter.learn(recorder)
+        meter.step("save", 1, 1, "Files Saved")
+        return True
+
+    def writeReport(self):
+
+        """
+        Write the measurements of the run as JSON, next to the outputs
+        """
+
+        preproc = self.proc_object.input_object
+        stages = self.parent.recorder.stages
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "inputs": preproc.filePaths,
+            "satellite": preproc.satType,
+            "products": [name for required, name in preproc.resultStates if required],
+            "settings": preproc.settings,
+            "rows": self.filer.rows,
+            "cols": self.filer.cols,
+            "plannedPeak": self.proc_object.plannedPeak,
+            "wall": sum(record["wall"] for record in stages),
+            "cpu": sum(record["cpu"] for record in stages),
+            "bytesRead": self.filer.bytesRead,
+            "bytesWritten": self.filer.bytesWritten,
+            "stages": stages,
+        }
+        with open(self.filer.generateFileName("Run Report", "json"), "w") as outfile:
+            json.dump(report, outfile, indent=1, default=str)
+
+
+def processScene(filePaths, satType, resultStates, settings, parent):
+
+    """
+    Load, calculate and save a scene, one step after the other, in this thread
+    parent gets progress and errors, as mainLST.CarrierTask would
+    Returns an error message, or None if the scene was processed
+    """
+
+    loader = inputLoader(dict(filePaths), resultStates, satType, parent, settings)
+    proc = sceneProcessor(loader, resultStates, parent)
+    saver = outputSaver(proc, parent)
+
+    for step in (loader, proc, saver):
+        try:
+            result = step.run()
+        except Exception as exc:
+            parent.setError("%s: %s" % (type(exc).__name__, exc))
+            break
+        if not (result) and not (step.error):
+            step.error = "Aborted"
+        if step.error:
+            parent.setError(step.error)
+            break
+    parent.recorder.stop()
+    return parent.error
+
+
+## Bands of the statistics stack written by processSeries, see seriesStatistics
+STATISTICS = ["Mean", "Minimum", "Maximum", "Standard Deviation", "Count"]
+
+
+class seriesStatistics(object):
+
+    """
+    Per-pixel statistics of a product over many scenes on one grid, updated
+    a scene at a time with Welford's algorithm, so that only the running
+    values are held and never more than one scene
+    Running arrays are kept in space (a workspace), if given
+    dtype, see PRECISIONS, is that of minimum, maximum and the statistics;
+    mean and spread are summed in float64 whatever it is
+    """
+
+    def __init__(self, rows, cols, space=None, chunkRows=512, dtype=np.float32):
+
+        self.rows = rows
+        self.cols = cols
+        self.dtype = np.dtype(dtype)
+        self.chunkRows = chunkRows  ## Rows updated at once, bounds temporaries
+        self.scenes = 0
+
+        space = space or workspace()
+        self.count = space.get("series count", (rows, cols), np.uint16)
+        self.mean = space.get("series mean", (rows, cols), np.float64)
+        self.m2 = space.get("series m2", (rows, cols), np.float64)
+        self.minimum = space.get("series minimum", (rows, cols), self.dtype)
+        self.maximum = space.get("series maximum", (rows, cols), self.dtype)
+        self.count.fill(0)
+        self.mean.fill(0)
+        self.m2.fill(0)
+        self.minimum.fill(np.inf)
+        self.maximum.fill(-np.inf)
+
+    def add(self, array, xoff=0, yoff=0):
+
+        """
+        Take in the values of a scene, nan where it has none, with its top
+        left corner at (xoff, yoff) of the grid. Parts off the grid are left out
+        Returns the number of pixels updated
+        """
+
+        y0, y1 = max(0, yoff), min(self.rows, yoff + array.shape[0])
+        x0, x1 = max(0, xoff), min(self.cols, xoff + array.shape[1])
+        self.scenes += 1
+        if y0 >= y1 or x0 >= x1:
+            return 0
+
+        updated = 0
+        for start in range(y0, y1, self.chunkRows):
+            stop = min(start + self.chunkRows, y1)
+            values = array[start - yoff : stop - yoff, x0 - xoff : x1 - xoff]
+            window = (slice(start, stop), slice(x0, x1))
+            valid = ~np.isnan(values)
+
+            x = values[valid].astype(np.float64)
+            count = self.count[window]
+            n = count[valid] + 1
+            count[valid] = n
+            mean = self.mean[window]
+            m = mean[valid]
+            delta = x - m
+            m += delta / n
+            mean[valid] = m
+            m2 = self.m2[window]
+            m2[valid] += delta * (x - m)
+
+            ## fmin and fmax ignore nan
+            np.fmin(self.minimum[window], values, out=self.minimum[window])
+            np.fmax(self.maximum[window], values, out=self.maximum[window])
+            updated += x.size
+        return updated
+
+    def statistic(self, name):
+
+        """
+        One of STATISTICS, as an array of dtype, nan where no scene had a value
+        Standard deviation is that of a sample, nan with fewer than 2 values
+        """
+
+        if name == "Count":
+            return self.count.astype(self.dtype)
+        if name == "Standard Deviation":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                variance = self.m2 / (self.count.astype(np.float64) - 1)
+            variance[self.count < 2] = np.nan
+            return np.sqrt(np.maximum(variance, 0)).astype(self.dtype)
+
+        array = {"Mean": self.mean, "Minimum": self.minimum, "Maximum": self.maximum}[name]
+        out = array.astype(self.dtype)
+        out[self.count == 0] = np.nan
+        return out
+
+
+def processSeries(scenes, product, settings, parent, outFolder=""):
+
+    """
+    Per-pixel statistics of one product (a key of PRODUCTS) over many scenes
+    of the same path and row, each a (filePaths, satType) pair as with
+    processScene. Scenes are calculated whole, one after the other, added to
+    a seriesStatistics on the grid of the first and dropped. Those that fail,
+    or are not on that grid, are skipped.
+    Writes the statistics as the bands of "<product name> Statistics.TIF",
+    and a "Series Report.json" listing the scenes
+    Returns a dict per scene: its inputs, pixels added and error, if any
+    """
+
+    name = dict(PRODUCTS)[product]
+    resultStates = [(key == product, default) for key, default in PRODUCTS]
+    ## Statistics are of full resolution values
+    sceneSettings = dict(settings, blockSize=0, multiband=False, aggregate=1)
+    space = workspace(settings.get("scratch", ""))
+    reference = None
+    stats = None
+    summary = []
+
+    for filePaths, satType in scenes:
+        record = {"inputs": dict(filePaths), "satellite": satType, "pixels": 0, "error": None}
+        summary.append(record)
+        inputs = dict(filePaths)
+        inputs.pop("output", None)  ## Only the statistics are written
+        loader = inputLoader(inputs, resultStates, satType, parent, sceneSettings)
+        proc = sceneProcessor(loader, resultStates, parent)
+        try:
+            for step in (loader, proc):
+                if not (step.run()) and not (step.error):
+                    step.error = "Aborted"
+                if step.error:
+                    record["error"] = step.error
+                    break
+        except Exception as exc:
+            record["error"] = "%s: %s" % (type(exc).__name__, exc)
+        record["satellite"] = loader.satType
+        if record["error"]:
+            continue
+
+        filer = loader.filer
+        values = proc.results[name]
+        if proc.compacted is not None:
+            values = filer.expand(values, proc.compacted)
+        if reference is None:  ## Only the grid is kept, to write the statistics on
+            reference = fileio.fileHandler()
+            reference.setGridInfo(filer.gridInfo())
+            stats = seriesStatistics(
+                filer.rows, filer.cols, space, dtype=settings.get("precision", "float32")
+            )
+        offset = reference.gridOffset(filer)
+        if offset is None:
+            record["error"] = "Not on the grid of the first scene"
+        else:
+            record["pixels"] = stats.add(values, *offset)
+
+        ## Nothing of the scene is kept
+        del values
+        proc.results = dict()
+        proc.space.clear()
+        loader.bands = dict()
+
+    if stats is None:
+        parent.setError("No scene could be calculated")
+        parent.recorder.stop()
+        return summary
+
+    filer = reference
+    filer.profile = settings.get("profile", "Plain")
+    filer.precision = settings.get("precision", "float32")
+    filer.prepareOutFolder(outFolder)
+    ## lse is stored with an offset, which its spread cannot take
+    spread = product if fileio.SCALED[product][1] == 0 else None
+    kinds = [product, product, product, spread, "count"]
+
+    with parent.recorder.stage("save") as measured:
+        fname = filer.generateFileName(name + " Statistics", "TIF")
+        filer.openOutput(fname, kinds, STATISTICS)
+        for band, statistic in enumerate(STATISTICS, 1):
+            filer.saveArray(stats.statistic(statistic), fname, band=band)
+        filer.closeOutputs()
+        measured["bytesWritten"] = filer.bytesWritten
+    space.clear()
+    parent.recorder.stop()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "product": product,
+        "settings": settings,
+        "rows": filer.rows,
+        "cols": filer.cols,
+        "scenes": summary,
+        "stages": parent.recorder.stages,
+    }
+    with open(filer.generateFileName("Series Report", "json"), "w") as outfile:
+        json.dump(report, outfile, indent=1, default=str)
+    return summary
@@ -1,11 +1,45 @@
 import numpy as np
-import gdal, os, tarfile
+import gdal, ogr, osr, os, tarfile, tempfile
 from zipfile import ZipFile
-import processing
-from qgis.core import QgsVectorLayer, QgsRasterLayer
 
 gdal.UseExceptions()
 
+## Ways of writing outputs: GTiff creation options, and optionally
+## "cog" - options of the cloud optimized copy made once an output is complete
+## "scaled" - products in SCALED are stored as Int16
+OUTPUT_PROFILES = {
+    "Plain": {"options": []},
+    "Deflate": {"options": ["COMPRESS=DEFLATE", "PREDICTOR=3", "TILED=YES"]},
+    "ZSTD": {"options": ["COMPRESS=ZSTD", "PREDICTOR=3", "TILED=YES"]},
+    "LZW": {"options": ["COMPRESS=LZW", "PREDICTOR=3", "TILED=YES"]},
+    "Cloud Optimized": {
+        "options": ["TILED=YES"],
+        "cog": ["COMPRESS=DEFLATE", "PREDICTOR=YES"],
+    },
+    "Scaled Int16": {
+        "options": ["COMPRESS=DEFLATE", "PREDICTOR=2", "TILED=YES"],
+        "scaled": True,
+    },
+}
+
+## (scale, offset) of each product when stored as Int16, value = stored * scale + offset
+SCALED = {
+    "toa": (0.001, 0),  ## W/(m2 sr um)
+    "bt": (0.01, 0),  ## 0.01 C
+    "ndvi": (0.0001, 0),
+    "pv": (0.0001, 0),
+    "lse": (0.00001, 0.9),
+    "lst": (0.01, 0),  ## 0.01 C
+    "count": (1, 0),  ## Scenes per pixel, of time series statistics
+}
+SCALED_NODATA = -32768
+
+## Name of the single output, when all products are written as its bands
+MULTIBAND_NAME = "Products"
+
+## Integer dtypes bands in raw are kept in, rather than converted to the precision
+RAW_DTYPES = [np.uint8, np.uint16]
+
 
 class fileHandler(object):
 
@@ -25,35 +59,231 @@ class fileHandler(object):
         self.geoTransform = None
         self.projection = None
 
-    def readBand(self, filepath):
+        ## Window of the input bands read, smaller than them when cropped
+        self.crop = False  ## Only read the window covering the shapefile
+        self.xoff = 0
+        self.yoff = 0
+
+        ## Block by block reading and writing
+        self.sources = dict()  ## Filepath of each band, or its array if held in memory
+        self.datasets = dict()  ## Open input datasets, by band
+        self.outputs = dict()  ## Open output datasets, by filepath
+
+        ## Output format
+        self.profile = "Plain"  ## Key of OUTPUT_PROFILES
+        self.kinds = dict()  ## Product (key of SCALED) of each output name
+        self.encodings = dict()  ## (scale, offset) of open scaled bands, by (filepath, band)
+        self.multiband = False  ## Write all outputs as bands of MULTIBAND_NAME
+        self.bandNames = []  ## Output names, in band order, when multiband
+        self.aggregate = 1  ## Input pixels per side of each output pixel
+        self.precision = "float32"  ## dtype of bands read and outputs written
+        self.raw = []  ## Bands kept as digital numbers when integer, see RAW_DTYPES
+
+        self.cache = None  ## cache.productCache for rasterized shapefiles, if any
+
+        ## Measurements, for the run report
+        self.bytesRead = 0  ## Raster data read, uncompressed
+        self.bytesWritten = 0  ## Raster data written, uncompressed
+        self.onRead = None  ## Called with the filepath of each whole band read
+        self.onWrite = None  ## Called with the name of each output saved by saveAll
+
+    def readInfo(self, filepath, im=None):
 
         """
-        Given a filepath, read a numpy array from its data
         Save tif data for future use, if the class has not already done so
         """
 
-        im = gdal.Open(filepath)
-        array = im.ReadAsArray().astype(np.float32)
         if not (self.folder):
             self.folder = filepath[: filepath.rfind("/")]
-        if not (self.driver):
-            self.rows = im.RasterYSize
-            self.cols = im.RasterXSize
-            self.driver = im.GetDriver()
-            self.geoTransform = im.GetGeoTransform()
-            self.projection = im.GetProjection()
-            layer = QgsRasterLayer(filepath, "Temp")
-            self.extent = layer.extent()
-            self.crs = layer.crs()
+        if self.driver:
+            return
+        if im is None:
+            im = gdal.Open(filepath)
+        self.rows = im.RasterYSize
+        self.cols = im.RasterXSize
+        self.driver = im.GetDriver()
+        self.geoTransform = im.GetGeoTransform()
+        self.projection = im.GetProjection()
+
+    def gridInfo(self):
+
+        """
+        The tif data saved by readInfo, as a json serialisable dict
+        """
+
+        return {
+            "folder": self.folder,
+            "rows": self.rows,
+            "cols": self.cols,
+            "driver": self.driver.ShortName,
+            "geoTransform": list(self.geoTransform),
+            "projection": self.projection,
+        }
+
+    def setGridInfo(self, info):
+
+        """
+        Take the tif data from a dict made by gridInfo, instead of a file
+        """
+
+        if not (self.folder):
+            self.folder = info["folder"]
+        self.rows = info["rows"]
+        self.cols = info["cols"]
+        self.driver = gdal.GetDriverByName(info["driver"])
+        self.geoTransform = tuple(info["geoTransform"])
+        self.projection = info["projection"]
+
+    def gridOffset(self, other):
+
+        """
+        Offset (xoff, yoff), in pixels, of the top left corner of the grid of
+        other (a fileHandler) on this one, or None if they do not share pixels:
+        the same projection, pixel size and pixel edges
+        """
+
+        mine, theirs = self.geoTransform, other.geoTransform
+        if self.projection != other.projection:
+            return None
+        for i in (1, 2, 4, 5):
+            if abs(mine[i] - theirs[i]) > 1e-6 * abs(mine[1]):
+                return None
+        xoff = (theirs[0] - mine[0]) / mine[1]
+        yoff = (theirs[3] - mine[3]) / mine[5]
+        if abs(xoff - round(xoff)) > 1e-3 or abs(yoff - round(yoff)) > 1e-3:
+            return None
+        return int(round(xoff)), int(round(yoff))
+
+    def readBand(self, filepath, raw=False):
+
+        """
+        Given a filepath, read a numpy array from its data
+        Save tif data for future use, if the class has not already done so
+        Only the window of the grid is read, if it has been cropped
+        If raw, integer data is returned as read, see convert
+        """
+
+        im = gdal.Open(filepath)
+        self.readInfo(filepath, im)
+        array = im.ReadAsArray(self.xoff, self.yoff, self.cols, self.rows)
+        self.bytesRead += array.nbytes
         del im
-        return array
+        if self.onRead:
+            self.onRead(filepath)
+        return self.convert(array, raw)
 
-    def loadZip(self, filePaths):
+    def convert(self, array, raw=False):
+
+        """
+        Band data read, in the precision, unless raw and in one of RAW_DTYPES
+        """
+
+        if raw and array.dtype in RAW_DTYPES:
+            return array
+        return array.astype(self.precision)
+
+    def cropToShape(self, vectorfname, filepath):
+
+        """
+        With the crop setting, shrink the grid to the window of the input
+        bands covering the features of a shapefile, and move the
+        geotransform to match. filepath is one of the bands, for the grid
+        Returns an error message, if any
+        """
+
+        if not (self.crop) or not (vectorfname.lower().endswith(".shp")):
+            return
+        self.readInfo(filepath)
+        gt = self.geoTransform
+        if gt[2] or gt[4]:
+            return  ## Rotated grids are read whole
+
+        source = ogr.Open(vectorfname)
+        if source is None:
+            return "Could not read shapefile"
+        layer = source.GetLayer(0)
+        xmin, xmax, ymin, ymax = layer.GetExtent()
+
+        ## Trace the whole outline of the extent, edges bend when reprojected
+        across = xmin + (xmax - xmin) * np.linspace(0, 1, 21)
+        up = ymin + (ymax - ymin) * np.linspace(0, 1, 21)
+        xs = np.concatenate([across, np.full(21, xmax), across[::-1], np.full(21, xmin)])
+        ys = np.concatenate([np.full(21, ymin), up, np.full(21, ymax), up[::-1]])
+        vectorRef = layer.GetSpatialRef()
+        gridRef = osr.SpatialReference(wkt=self.projection)
+        if vectorRef and not (vectorRef.IsSame(gridRef)):
+            if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):  ## x, y order on GDAL 3
+                vectorRef.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                gridRef.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            transform = osr.CoordinateTransformation(vectorRef, gridRef)
+            points = np.array(transform.TransformPoints(list(zip(xs, ys))))
+            xs, ys = points[:, 0], points[:, 1]
+
+        cols = (xs - gt[0]) / gt[1]
+        rows = (ys - gt[3]) / gt[5]
+        xoff = max(0, int(np.floor(cols.min())))
+        xend = min(self.cols, int(np.ceil(cols.max())))
+        yoff = max(0, int(np.floor(rows.min())))
+        yend = min(self.rows, int(np.ceil(rows.max())))
+        if xoff >= xend or yoff >= yend:
+            return "Shapefile does not overlap the scene"
+
+        self.xoff = xoff
+        self.yoff = yoff
+        self.cols = xend - xoff
+        self.rows = yend - yoff
+        self.geoTransform = (gt[0] + xoff * gt[1], gt[1], 0, gt[3] + yoff * gt[5], 0, gt[5])
+
+    def readWindow(self, yoff, ysize):
+
+        """
+        Read the same strip of rows from every band in sources
+        Returns a dict of numpy arrays, keyed by band name
+        Datasets are kept open for the next strip, until closeInputs
+        """
+
+        bands = dict()
+        for band in self.sources:
+            if isinstance(self.sources[band], np.ndarray):
+                bands[band] = self.convert(
+                    self.sources[band][yoff : yoff + ysize], band in self.raw
+                )
+                continue
+            if band not in self.datasets:
+                self.datasets[band] = gdal.Open(self.sources[band])
+            array = self.datasets[band].ReadAsArray(self.xoff, self.yoff + yoff, self.cols, ysize)
+            self.bytesRead += array.nbytes
+            bands[band] = self.convert(array, band in self.raw)
+        return bands
+
+    def closeInputs(self):
+
+        """
+        Close datasets left open by readWindow
+        """
+
+        self.datasets = dict()
+
+    def virtualRoot(self, filepath):
+
+        """
+        Path of a compressed file in GDAL's virtual file systems,
+        through which its members are read in place, without extracting
+        """
+
+        if filepath.lower().endswith(".zip"):
+            return "/vsizip/" + filepath
+        return "/vsitar/" + filepath  ## Also reads gzipped tars
+
+    def loadZip(self, filePaths, readData=True, virtual=False):
 
         """
         Compatible with zip, tar and gz extensions
         Read only Red, Near IR and Thermal IR bands
         Get satellite type by looking at the name of the metadata file.
+        If readData is False, bands are only located, for readWindow
+        If virtual is True, bands are read from inside the compressed file
+        instead of being extracted, leaving nothing behind on disk
         """
 
         filepath = filePaths["zip"]
@@ -65,34 +295,47 @@ class fileHandler(object):
         if not (recognised):
             bands["Error"] = "Unknown compressed file format"
             return bands
+        ## A gzipped single file holds no metadata, only tars and zips hold a scene
+        if filepath.lower().endswith(".gz") and not (tarfile.is_tarfile(filepath)):
+            bands["Error"] = "Plain .gz files are not supported - please use the .tar.gz download"
+            return bands
         self.folder = filepath[: filepath.rfind("/")]
 
-        if filepath.lower().endswith(".zip"):
-            compressed = ZipFile(filepath, "r")
-            extract = compressed.extract
-            listoffiles = compressed.namelist()
-        elif filepath.lower().endswith(".gz"):
-            compressed = tarfile.open(filepath, "r:gz")
-            extract = compressed.extract
-            listoffiles = [member.name for member in compressed.getmembers()]
+        compressed = None
+        if virtual:
+            root = self.virtualRoot(filepath)
+            listoffiles = gdal.ReadDirRecursive(root) or []
+            locate = lambda filename: root + "/" + filename
         else:
-            compressed = tarfile.open(filepath, "r")
-            extract = compressed.extract
-            listoffiles = compressed.getmembers()
+            if filepath.lower().endswith(".zip"):
+                compressed = ZipFile(filepath, "r")
+                listoffiles = compressed.namelist()
+            elif filepath.lower().endswith(".gz"):
+                compressed = tarfile.open(filepath, "r:gz")
+                listoffiles = compressed.getnames()
+            else:
+                compressed = tarfile.open(filepath, "r")
+                listoffiles = compressed.getnames()
+
+            def locate(filename):
+                compressed.extract(filename)
+                return filename
 
         for filename in listoffiles:
-            if filename.upper().endswith("MTL.TXT"):
-                if filename[:4] == "LC08":
+            basename = os.path.basename(filename)
+            if basename.upper().endswith("MTL.TXT"):
+                if basename[:4] == "LC08":
                     bands["sat_type"] = "Landsat8"
                     sat_type = "Landsat8"
-                if filename[:4] == "LT05":
+                if basename[:4] == "LT05":
                     bands["sat_type"] = "Landsat5"
                     sat_type = "Landsat5"
         if "sat_type" not in bands:
             bands[
                 "Error"
             ] = "Unknown satellite - Please verify that files have not been renamed"
-            compressed.close()
+            if compressed:
+                compressed.close()
             return bands
 
         sat_bands = {
@@ -109,127 +352,362 @@ class fileHandler(object):
             bands[band] = np.array([])
             for filename in listoffiles:
                 if filename.upper().endswith(sat_bands[sat_type][band] + ".TIF"):
-                    extract(filename)
-                    filePaths[band] = filename
-        compressed.close()
+                    filePaths[band] = locate(filename)
+        if compressed:
+            compressed.close()
+
+        if shapefile:
+            error = self.cropToShape(shapefile, filePaths["Red"])
+            if error:
+                bands["Error"] = error
+                return bands
         for band in ("Red", "Near-IR", "Thermal-IR"):
-            bands[band] = self.readBand(filePaths[band])
+            self.sources[band] = filePaths[band]
+            if readData:
+                bands[band] = self.readBand(filePaths[band], band in self.raw)
+            else:
+                self.readInfo(filePaths[band])
 
         if shapefile:
-            bands["Shape"] = self.readShapeFile(shapefile)
-            if type(bands["Shape"]) == str:
-                bands["Error"] = bands["Shape"]
+            shape = self.readShapeFile(shapefile, readData)
+            if type(shape) == str:
+                bands["Error"] = shape
                 return bands
+            if readData:
+                bands["Shape"] = shape
         return bands
 
-    def loadBands(self, filepaths):
+    def loadBands(self, filepaths, readData=True):
 
         """
         Gets band data as numpy arrays, from a dict of filepaths
+        If readData is False, bands are only located, for readWindow
         """
 
         bands = {"Error": None}
-        for band in filepaths:
-            if band == "Shape":
-                continue
+        tifs = [band for band in filepaths if band != "Shape"]
+        for band in tifs:
             if not (filepaths[band].lower().endswith(".tif")):
                 bands["Error"] = "Bands must be TIFs"
                 return bands
-            bands[band] = self.readBand(filepaths[band])
+
+        if "Shape" in filepaths and tifs:
+            error = self.cropToShape(filepaths["Shape"], filepaths[tifs[0]])
+            if error:
+                bands["Error"] = error
+                return bands
+        for band in tifs:
+            self.sources[band] = filepaths[band]
+            if readData:
+                bands[band] = self.readBand(filepaths[band], band in self.raw)
+            else:
+                self.readInfo(filepaths[band])
         if "Shape" in filepaths:
-            bands["Shape"] = self.readShapeFile(filepaths["Shape"])
-            if type(bands["Shape"]) == str:
-                bands["Error"] = bands["Shape"]
+            shape = self.readShapeFile(filepaths["Shape"], readData)
+            if type(shape) == str:
+                bands["Error"] = shape
                 return bands
+            if readData:
+                bands["Shape"] = shape
         return bands
 
-    def readShapeFile(self, vectorfname):
+    def readShapeFile(self, vectorfname, readData=True):
 
         """
         Get a rasterized numpy array from the features of a shapefile
+        If readData is False, the raster is only located, for readWindow
         """
 
         if not (vectorfname.lower().endswith(".shp")):
             return "Shapes must be SHPs"
-        vlayer = self.loadVectorLayer(vectorfname)
-        shapefile = self.generateFileName("Shape", "TIF")
-        self.rasterize(vlayer, shapefile)
-        return self.readBand(shapefile)
 
-    def saveArray(self, array, fname):
+        key = None
+        if self.cache:
+            key = self.shapeKey(vectorfname)
+            shape = self.cache.load(key)
+            if shape is not None:
+                self.sources["Shape"] = shape
+                if readData:
+                    return shape
+
+        shape = self.rasterize(vectorfname)
+        if type(shape) == str:
+            return shape
+        self.sources["Shape"] = shape
+        if key:
+            self.cache.store(key, shape)
+        if readData:
+            return shape
+
+    def shapeKey(self, vectorfname):
 
         """
-        Saves array as tiff file named fname
-        Use TIF info saved by the class on input
-        Should not be used directly, use saveAll instead
+        Cache key of a shapefile rasterized on the input grid
+        Made from the contents of the shapefile and its sidecar files, and
+        the grid alone, so that scenes of the same path and row in other
+        folders share it
+        """
+
+        base = os.path.splitext(vectorfname)[0]
+        parts = [base + ext for ext in (".shp", ".shx", ".dbf", ".prj", ".cpg")]
+        grid = [self.rows, self.cols, list(self.geoTransform), self.projection]
+        return self.cache.key(
+            "Shape",
+            self.cache.contentIdentity([part for part in parts if os.path.isfile(part)]),
+            grid,
+        )
+
+    def outputGrid(self):
+
+        """
+        Columns, rows and geotransform of outputs: the input grid, made
+        coarser by aggregate. Edge pixels cover what is left of the input
+        """
+
+        factor = self.aggregate
+        gt = self.geoTransform
+        return (
+            -(-self.cols // factor),
+            -(-self.rows // factor),
+            (gt[0], gt[1] * factor, gt[2] * factor, gt[3], gt[4] * factor, gt[5] * factor),
+        )
+
+    def createDataset(self, fname, kinds=(None,), names=None):
+
+        """
+        Create an empty tiff file named fname, on the output grid
+        Written as the output profile says, in the precision unless it is scaled
+        kinds are the products (keys of SCALED) stored in each of its bands,
+        names, if given, are set as the band descriptions
         """
 
-        outDS = self.driver.Create(
-            fname, self.cols, self.rows, bands=1, eType=gdal.GDT_Float32
+        profile = OUTPUT_PROFILES[self.profile]
+        scalings = [SCALED.get(kind) if profile.get("scaled") else None for kind in kinds]
+        scaled = all(scalings)
+
+        driver = self.driver
+        if profile["options"] or profile.get("cog"):
+            driver = gdal.GetDriverByName("GTiff")
+        target = self.partPath(fname) if profile.get("cog") else fname
+        if scaled:
+            eType = gdal.GDT_Int16
+        elif self.precision == "float64":
+            eType = gdal.GDT_Float64
+        else:
+            eType = gdal.GDT_Float32
+
+        cols, rows, geoTransform = self.outputGrid()
+        outDS = driver.Create(
+            target,
+            cols,
+            rows,
+            bands=len(kinds),
+            eType=eType,
+            options=profile["options"],
         )
-        outBand = outDS.GetRasterBand(1)
-        outBand.WriteArray(array)
-        outBand.FlushCache()
-        outDS.SetGeoTransform(self.geoTransform)
+        outDS.SetGeoTransform(geoTransform)
         outDS.SetProjection(self.projection)
+        for band in range(1, len(kinds) + 1):
+            outBand = outDS.GetRasterBand(band)
+            if names:
+                outBand.SetDescription(names[band - 1])
+            if scaled:
+                scale, offset = scalings[band - 1]
+                outBand.SetScale(scale)
+                outBand.SetOffset(offset)
+                outBand.SetNoDataValue(SCALED_NODATA)
+                self.encodings[(fname, band)] = (scale, offset)
+        return outDS
+
+    def partPath(self, fname):
+
+        """
+        Local temporary file a cloud optimized output is written to, before
+        it is laid out, so that the output folder only gets the final file
+        """
+
+        handle, path = tempfile.mkstemp(".part.tif", os.path.basename(fname) + ".")
+        os.close(handle)
+        return path
+
+    def openOutput(self, fname, kinds=(None,), names=None):
+
+        """
+        Create an output, to be filled in by saveArray, until closeOutput
+        See createDataset
+        """
+
+        self.outputs[fname] = self.createDataset(fname, kinds, names)
+
+    def outputPath(self, name):
 
+        """
+        Filepath and band an output name is written to
+        """
+
+        if self.multiband:
+            return (
+                self.generateFileName(MULTIBAND_NAME, "TIF"),
+                self.bandNames.index(name) + 1,
+            )
+        return self.generateFileName(name, "TIF"), 1
+
+    def outputLayers(self, names):
+
+        """
+        Filepaths and layer names to display the outputs with
+        """
+
+        if self.multiband:
+            return [(self.generateFileName(MULTIBAND_NAME, "TIF"), MULTIBAND_NAME)]
+        return [(self.generateFileName(name, "TIF"), name) for name in names]
+
+    def closeOutput(self, fname):
+
+        """
+        Flush and close an output opened by openOutput
+        Cloud optimized outputs are only laid out now, from the part written
+        """
+
+        outDS = self.outputs.pop(fname)
+        for band in range(1, outDS.RasterCount + 1):
+            self.encodings.pop((fname, band), None)
+        outDS.FlushCache()
+        if not (OUTPUT_PROFILES[self.profile].get("cog")):
+            del outDS
+            return
+
+        part = outDS.GetDescription()
+        cog = gdal.GetDriverByName("COG")
+        if cog:
+            cog.CreateCopy(fname, outDS, options=OUTPUT_PROFILES[self.profile]["cog"])
+        else:  ## GDAL before 3.1, the same layout by hand
+            outDS.BuildOverviews("AVERAGE", [2, 4, 8, 16])
+            options = ["TILED=YES", "COPY_SRC_OVERVIEWS=YES", "COMPRESS=DEFLATE"]
+            gdal.GetDriverByName("GTiff").CreateCopy(fname, outDS, options=options)
         del outDS
-        del array
+        gdal.Unlink(part)
+
+    def createOutputs(self, names):
 
         """
-        DavidF's answer at
-        https://gis.stackexchange.com/questions/37238/writing-numpy-array-to-raster-file
-        was incredibly useful.
+        Create an empty output for each name, to be filled in by saveResult
+        block by block. Outputs stay open until closeOutputs.
         """
 
-    def loadVectorLayer(self, fname):
+        if not (self.outfolder):
+            self.prepareOutFolder()
+
+        if self.multiband:
+            self.bandNames = list(names)
+            kinds = [self.kinds.get(name) for name in names]
+            if names:
+                fname = self.generateFileName(MULTIBAND_NAME, "TIF")
+                self.openOutput(fname, kinds, names)
+            return
+        for name in names:
+            self.openOutput(self.generateFileName(name, "TIF"), [self.kinds.get(name)])
+
+    def closeOutputs(self):
+
+        """
+        Flush and close outputs opened by createOutputs
+        """
+
+        for fname in list(self.outputs):
+            self.closeOutput(fname)
+
+    def expand(self, array, mask, out=None):
+
+        """
+        Scatter the valid pixels in array back onto the grid of mask
+        Masked pixels are set to nan. out, if given, is reused for the result
+        """
+
+        if out is None:
+            out = np.empty(mask.shape, array.dtype)
+        out.fill(np.nan)
+        out[mask] = array
+        return out
+
+    def encode(self, array, scaling):
+
+        """
+        Convert array to scaled integers, nan becomes the nodata value
+        """
+
+        scale, offset = scaling
+        encoded = (array - offset) / scale
+        np.round(encoded, out=encoded)
+        np.clip(encoded, SCALED_NODATA + 1, np.iinfo(np.int16).max, out=encoded)
+        encoded[np.isnan(encoded)] = SCALED_NODATA
+        return encoded.astype(np.int16)
+
+    def saveResult(self, name, array, yoff=0, mask=None):
+
+        """
+        Write a block of rows of output name, opened by createOutputs
+        """
+
+        fname, band = self.outputPath(name)
+        self.saveArray(array, fname, 0, yoff, mask, band)
+
+    def saveArray(self, array, fname, xoff=0, yoff=0, mask=None, band=1):
 
         """
-        Load a vector layer, using qgis core functionality
+        Saves array as tiff file named fname
+        Use TIF info saved by the class on input
+        If fname was opened by createOutputs, array is written into its band
+        as a block, with its top left corner at (xoff, yoff)
+        If mask is given, array only holds its valid pixels, see expand
+        Should not be used directly, use saveAll instead
         """
 
-        layer = QgsVectorLayer(fname, "Shape", "ogr")
-        return layer
+        if mask is not None:
+            array = self.expand(array, mask)
 
-    def rasterize(self, vlayer, fname, res=30):
+        standalone = fname not in self.outputs
+        if standalone:
+            self.openOutput(fname)
+
+        if (fname, band) in self.encodings:
+            array = self.encode(array, self.encodings[(fname, band)])
+        else:
+            array = np.asarray(array, self.precision)
+        self.outputs[fname].GetRasterBand(band).WriteArray(array, xoff, yoff)
+        self.bytesWritten += array.nbytes
+
+        if standalone:
+            self.closeOutput(fname)
+        del array
 
         """
-        Convert a vector layer to a raster layer, handle CRS differences
+        DavidF's answer at
+        https://gis.stackexchange.com/questions/37238/writing-numpy-array-to-raster-file
+        was incredibly useful.
         """
 
-        rfile = self.driver.Create(
-            fname, self.cols, self.rows, bands=1, eType=gdal.GDT_Float32
+    def rasterize(self, vectorfname):
+
+        """
+        Burn the features of a vector file into a mask on the input grid,
+        reprojecting them on the fly if their CRS is different
+        Returns a uint8 array, 0 inside features and 1 outside, or an error
+        """
+
+        source = ogr.Open(vectorfname)
+        if source is None:
+            return "Could not read shapefile"
+
+        target = gdal.GetDriverByName("MEM").Create(
+            "", self.cols, self.rows, 1, gdal.GDT_Byte
         )
-        rfile.SetProjection(self.projection)
-        rfile.SetGeoTransform(self.geoTransform)
-        rfile = None
-
-        if self.crs != vlayer.crs():
-            parameters = {
-                "INPUT": vlayer,
-                "TARGET_CRS": self.crs,
-                "OUTPUT": "TEMPORARY_OUTPUT",
-            }
-            vlayer = processing.run("native:reprojectlayer", parameters)["OUTPUT"]
-
-        xmin = self.extent.xMinimum()
-        xmax = self.extent.xMaximum()
-        ymin = self.extent.yMinimum()
-        ymax = self.extent.yMaximum()
-
-        parameters = {
-            "INPUT": vlayer,
-            "HEIGHT": res,
-            "WIDTH": res,
-            "BURN": 0,
-            "UNITS": 1,
-            "EXTENT": "%f,%f,%f,%f" % (xmin, xmax, ymin, ymax),
-            "DATA_TYPE": 5,
-            "NODATA": 1,
-            "OUTPUT": fname,
-        }
-        processing.run("gdal:rasterize", parameters)
-        vlayer = None
+        target.SetProjection(self.projection)
+        target.SetGeoTransform(self.geoTransform)
+        band = target.GetRasterBand(1)
+        band.Fill(1)
+        gdal.RasterizeLayer(target, [1], source.GetLayer(0), burn_values=[0])
+        return band.ReadAsArray()
 
     def prepareOutFolder(self, opFolder=""):
 
@@ -258,15 +736,34 @@ class fileHandler(object):
             self.prepareOutFolder()
         return self.outfolder + "/" + topic + "." + ftype
 
-    def saveAll(self, arrays):
+    def saveAll(self, arrays, mask=None, profile=None):
 
         """
         Write each of a dict of arrays as TIF outputs
+        If mask is given, arrays only hold its valid pixels, see expand
+        profile, a key of OUTPUT_PROFILES, replaces the one set before
         """
 
         if not (self.outfolder):
             self.prepareOutFolder()
+        if profile:
+            self.profile = profile
+
+        if self.multiband and arrays:
+            self.createOutputs(list(arrays))
 
+        full = None
         for resultName in arrays:
-            filepath = self.generateFileName(resultName, "TIF")
-            self.saveArray(arrays[resultName], filepath)
+            filepath, band = self.outputPath(resultName)
+            array = arrays[resultName]
+            if mask is not None:
+                full = self.expand(array, mask, full)
+                array = full
+            if not (self.multiband):
+                self.openOutput(filepath, [self.kinds.get(resultName)])
+            self.saveArray(array, filepath, band=band)
+            if not (self.multiband):
+                self.closeOutput(filepath)
+            if self.onWrite:
+                self.onWrite(resultName)
+        self.closeOutputs()
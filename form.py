@@ -4,9 +4,9 @@ from qgis.PyQt.QtCore import *
 
 from qgis.core import *
 
-import time
+import os, time
 
-from . import mainLST, procedures
+from . import mainLST, procedures, fileio, engine
 
 
 class MainWindow(QMainWindow):
@@ -25,6 +25,7 @@ class MainWindow(QMainWindow):
         super(MainWindow, self).__init__()
 
         self.filePaths = dict()
+        self.settings = dict()
         self.running = False
         self.error = None
         self.checkboxes = []
@@ -102,12 +103,8 @@ class MainWindow(QMainWindow):
         self.layout.addWidget(label)
 
         # checkbox for various outputs
-        self.addCheckBox("TOA Spectral Radiance")
-        self.addCheckBox("At Sensor Brightness Temperature")
-        self.addCheckBox("NDVI")
-        self.addCheckBox("Proportion of Vegetation")
-        self.addCheckBox("Land Surface Emissivity")
-        self.addCheckBox("Land Surface Temperature", defaultChecked=True)
+        for key, name in engine.PRODUCTS:
+            self.addCheckBox(name, defaultChecked=(key == "lst"))
 
         # horizontal line seperator
         h_line = QFrame()
@@ -136,6 +133,34 @@ class MainWindow(QMainWindow):
         h_line.setFrameShape(QFrame.HLine)
         self.layout.addWidget(h_line)
 
+        # performance settings, optional
+        label = QLabel("Optional - Performance Settings")
+        label.setAlignment(Qt.AlignCenter)
+        self.layout.addWidget(label)
+
+        self.addSpinBox("Rows per block (0 for whole scene)", "blockSize", 0, 100000, 0)
+        self.addToggle("Fused calculation (faster, less memory)", "fused")
+        self.addToggle(
+            "Look up TOA and BT from digital numbers (same values, faster)", "thermalTables", True
+        )
+        self.addToggle("Read compressed files in place, without extracting", "virtual")
+        self.addToggle("Only calculate unmasked pixels", "compact")
+        self.addComboBox("Output format", "profile", list(fileio.OUTPUT_PROFILES))
+        self.addComboBox("Precision (float64 doubles memory)", "precision", engine.PRECISIONS)
+        self.addToggle("Write all outputs as bands of one file", "multiband")
+        self.addSpinBox("Input pixels per output pixel side (3 for 90 m)", "aggregate", 1, 100, 1)
+        self.addToggle("Only read the area around the shapefile", "crop")
+        self.addToggle("Read and write blocks while calculating others", "pipeline")
+        self.addToggle("Reuse outputs (whole scene only) and shapefile masks of earlier runs", "cache")
+        self.addSpinBox("Cache size (GB)", "cacheSize", 1, 1000, 10)
+        self.addSpinBox("Worker threads", "workers", 1, os.cpu_count() or 1, 1)
+        self.addToggle("Trace memory of each stage, for the run report (slower)", "traceMemory")
+        self.addFolderSetting("Scratch Folder (keeps large arrays out of RAM)", "scratch")
+
+        h_line = QFrame()
+        h_line.setFrameShape(QFrame.HLine)
+        self.layout.addWidget(h_line)
+
         # go button
         goButton = QPushButton("Go")
         goButton.clicked.connect(self.goFunc)
@@ -270,12 +295,14 @@ class MainWindow(QMainWindow):
 
         self.virtualTask = mainLST.CarrierTask(self)
         self.virtualTask.progressChanged.connect(self.update_progress)
-        self.preproc = mainLST.preprocess(self.filePaths, self.resultStates, satType, self.virtualTask)
+        self.preproc = mainLST.preprocess(
+            self.filePaths, self.resultStates, satType, self.virtualTask, dict(self.settings)
+        )
         self.proc = procedures.processor(self.preproc, self.resultStates, self.virtualTask)
         self.postproc = mainLST.postprocess(self.proc, self.virtualTask)
-        self.virtualTask.addSubTask(self.preproc)
-        self.virtualTask.addSubTask(self.proc, [self.preproc])
-        self.virtualTask.addSubTask(self.postproc, [self.proc])
+        self.virtualTask.addStep(self.preproc)
+        self.virtualTask.addStep(self.proc, [self.preproc])
+        self.virtualTask.addStep(self.postproc, [self.proc])
         QgsApplication.taskManager().addTask(self.virtualTask)
 
         return
@@ -296,10 +323,16 @@ class MainWindow(QMainWindow):
 
         if(self.virtualTask.progress() != 100):
             self.virtualTask.cancel()
-        else:
+        elif(not(self.virtualTask.error)):
             mainLST.displayOnScreen(self.resultStates, self.postproc.filer)
         time_taken = int(time.time() - self.start_time)
-        self.showStatus("Finished, process time - " + str(time_taken) + " seconds")
+        stages = ", ".join(
+            "%s %.1f s" % (record["name"], record["wall"])
+            for record in self.virtualTask.recorder.stages
+        )
+        self.showStatus(
+            "Finished, process time - " + str(time_taken) + " seconds (" + stages + ")"
+        )
         self.running = False
 
     def addCheckBox(self, text, defaultChecked=False):
@@ -327,6 +360,102 @@ class MainWindow(QMainWindow):
         self.layout.addWidget(widget)
         self.checkboxes.append((lstcheckbox, fname))
 
+    def addSpinBox(self, text, key, minimum, maximum, default):
+
+        """
+        Add a spin box that sets an integer entry of the run settings
+        """
+
+        widget = QWidget()
+        localLayout = QHBoxLayout()
+
+        label = QLabel(text)
+        label.setMinimumWidth(250)
+        localLayout.addWidget(label)
+
+        spinbox = QSpinBox()
+        spinbox.setFixedWidth(200)
+        spinbox.setRange(minimum, maximum)
+        spinbox.setValue(default)
+        spinbox.valueChanged.connect(lambda value: self.setSetting(key, value))
+        localLayout.addWidget(spinbox)
+
+        widget.setLayout(localLayout)
+
+        self.layout.addWidget(widget)
+        self.settings[key] = default
+
+    def addToggle(self, text, key, defaultChecked=False):
+
+        """
+        Add a checkbox that sets a boolean entry of the run settings
+        """
+
+        checkbox = QCheckBox(text)
+        checkbox.setChecked(defaultChecked)
+        checkbox.toggled.connect(lambda state: self.setSetting(key, state))
+        self.layout.addWidget(checkbox)
+        self.settings[key] = defaultChecked
+
+    def addComboBox(self, text, key, items):
+
+        """
+        Add a drop down list that sets a text entry of the run settings
+        The first item is the default
+        """
+
+        widget = QWidget()
+        localLayout = QHBoxLayout()
+
+        label = QLabel(text)
+        label.setMinimumWidth(250)
+        localLayout.addWidget(label)
+
+        combobox = QComboBox()
+        combobox.setFixedWidth(200)
+        combobox.addItems(items)
+        combobox.currentTextChanged.connect(lambda value: self.setSetting(key, value))
+        localLayout.addWidget(combobox)
+
+        widget.setLayout(localLayout)
+
+        self.layout.addWidget(widget)
+        self.settings[key] = items[0]
+
+    def addFolderSetting(self, text, key):
+
+        """
+        Add a line edit and button to choose a folder for the run settings
+        """
+
+        widget = QWidget()
+        localLayout = QHBoxLayout()
+
+        pathFold = QLineEdit()
+        pathFold.setPlaceholderText(text)
+        pathFold.textChanged.connect(lambda value: self.setSetting(key, value))
+        localLayout.addWidget(pathFold)
+
+        selfold = QPushButton()
+        selfold.setText("Select Folder")
+        selfold.clicked.connect(
+            lambda: pathFold.setText(QFileDialog.getExistingDirectory() or pathFold.text())
+        )
+        localLayout.addWidget(selfold)
+
+        widget.setLayout(localLayout)
+
+        self.layout.addWidget(widget)
+        self.settings[key] = ""
+
+    def setSetting(self, key, value):
+
+        """
+        Store a run setting, passed on to the tasks when Go is pressed
+        """
+
+        self.settings[key] = value
+
     def showStatus(self, text):
 
         """
@@ -0,0 +1,200 @@
+"""
+Measurements of the stages of a run, for benchmarks and run reports
+Only needs the standard library
+"""
+
+import os, sys, threading, time, tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  ## Windows
+    resource = None
+
+
+def peakRSS():
+
+    """
+    Largest resident set size of this process so far, in bytes, or 0 if
+    the platform does not say
+    """
+
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  ## KB on Linux
+
+
+def currentRSS():
+
+    """
+    Resident set size of this process now, in bytes, or 0 if the platform
+    does not say (only Linux does, through /proc)
+    """
+
+    try:
+        with open("/proc/self/statm") as infile:
+            return int(infile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+class rssSampler(object):
+
+    """
+    Samples the resident set size on a thread, keeping the largest seen,
+    until stopped
+    """
+
+    def __init__(self, interval=0.01):
+
+        self.interval = interval
+        self.peak = currentRSS()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+
+        while not (self.stopping.wait(self.interval)):
+            self.peak = max(self.peak, currentRSS())
+
+    def stop(self):
+
+        """
+        Stop sampling, returns the largest resident set size seen
+        """
+
+        self.stopping.set()
+        self.thread.join()
+        self.peak = max(self.peak, currentRSS())
+        return self.peak
+
+
+class stageRecorder(object):
+
+    """
+    Records wall time, CPU time and memory of named stages, in order
+    Peak memory of a stage is the largest traced allocation (numpy arrays
+    included) while it ran, only if this recorder started tracemalloc, see
+    start. Tracing slows every allocation of the process, so it is opt-in
+    rssIncrease of a stage is how far the resident set size rose above its
+    level at the start of the stage, sampled while it ran. Where it cannot
+    be sampled, it is how far the process high-water mark rose instead
+    peakRSS is the largest resident set size sampled while it ran, or the
+    process high-water mark where it cannot be sampled
+    """
+
+    def __init__(self):
+
+        self.stages = []
+        self.tracing = False  ## Whether tracemalloc was started here
+
+    def start(self, traceMemory=False):
+
+        """
+        Start tracing allocations if traceMemory, so that stages get a peak
+        Left alone if someone else is tracing: their peaks are theirs
+        """
+
+        if traceMemory and not (tracemalloc.is_tracing()):
+            tracemalloc.start()
+            self.tracing = True
+
+    def stop(self):
+
+        """
+        Stop tracing allocations, unless someone else had started it
+        """
+
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    @contextmanager
+    def stage(self, name, **extra):
+
+        """
+        Measure the body of a with statement as stage name
+        extra items are stored with its measurements
+        """
+
+        record = {"name": name}
+        record.update(extra)
+        tracing = self.tracing
+        if tracing:
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            else:  ## Before python 3.9, restarting is the only way
+                tracemalloc.stop()
+                tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+        rss = currentRSS()
+        sampler = rssSampler() if rss else None
+        highWater = peakRSS()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            if tracing:
+                record["peakBytes"] = tracemalloc.get_traced_memory()[1] - base
+            if sampler:
+                record["peakRSS"] = sampler.stop()
+                record["rssIncrease"] = record["peakRSS"] - rss
+            else:
+                record["peakRSS"] = peakRSS()
+                record["rssIncrease"] = record["peakRSS"] - highWater
+            self.stages.append(record)
+
+    def total(self, key="wall"):
+
+        return sum(record.get(key, 0) for record in self.stages)
+
+
+class workMeter(object):
+
+    """
+    Turns the measured progress of each stage into an overall percentage
+    Stages (see STAGES) count for their share of the time the last run
+    took, so that the percentage follows time rather than fixed numbers
+    """
+
+    STAGES = ["load", "calculate", "save"]
+    shares = {"load": 0.3, "calculate": 0.4, "save": 0.3}  ## Until a run is measured
+
+    def __init__(self, report):
+
+        """
+        report is called with a percentage and a message
+        """
+
+        self.report = report
+
+    def step(self, stage, done, total, text):
+
+        """
+        Report that done out of total units of work of stage are done
+        """
+
+        before = sum(self.shares[name] for name in self.STAGES[: self.STAGES.index(stage)])
+        fraction = float(done) / total if total else 1.0
+        num = int(100 * (before + self.shares[stage] * min(fraction, 1.0)))
+        self.report(num, "%d%% %s" % (num, text))
+
+    @classmethod
+    def learn(cls, recorder):
+
+        """
+        Take the shares of later runs from the stages of a recorder
+        """
+
+        times = dict()
+        for record in recorder.stages:
+            if record["name"] in cls.shares:
+                times[record["name"]] = times.get(record["name"], 0) + record["wall"]
+        total = sum(times.values())
+        if len(times) == len(cls.shares) and total > 0:
+            cls.shares = dict((name, times[name] / total) for name in times)
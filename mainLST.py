@@ -6,7 +6,9 @@ from qgis.core import *
 
 import time
 
-from . import form, resources, fileio
+## Only what initGui needs is imported here: form and engine, which bring in
+## numpy and GDAL, are imported on the first run, see run
+from . import resources, instrument
 
 ## Main class: LSTplugin
 
@@ -22,6 +24,8 @@ class LandSurfaceTemperatureV3(object):
         """
 
         self.iface = iface
+        self.loaded = False  ## Whether run has imported form yet
+        self.window = None
 
     def initGui(self):
 
@@ -55,10 +59,21 @@ class LandSurfaceTemperatureV3(object):
         """
         Called when plugin asked to run
         Starts a UI instance, defined in form.py
+        Loads the calculation modules on first use, later runs reuse them
         """
 
-        window = form.MainWindow(self.iface)
-        window.show()
+        start = time.perf_counter()
+        from . import form
+
+        if not (self.loaded):
+            self.loaded = True
+            QgsMessageLog.logMessage(
+                "Calculation modules loaded in %.0f ms" % (1000 * (time.perf_counter() - start)),
+                "Land Surface Temperature",
+                Qgis.Info,
+            )
+        self.window = form.MainWindow(self.iface)
+        self.window.show()
 
 
 def displayOnScreen(resultStates, filer):
@@ -69,31 +84,26 @@ def displayOnScreen(resultStates, filer):
 
     resultNames = []
     for res in resultStates:
-        resultNames.append(res[1])
+        if res[0]:
+            resultNames.append(res[1])
 
-    for i in range(6):
-        if resultStates[i][0]:
-            iface.addRasterLayer(
-                filer.generateFileName(resultNames[i], "TIF"), resultNames[i]
-            )
+    for path, name in filer.outputLayers(resultNames):
+        iface.addRasterLayer(path, name)
 
 class preprocess(QgsTask):
 
     """
-    This task obtains data from files
+    This task obtains data from files, see engine.inputLoader
     """
 
-    def __init__(self, filePaths, resultStates, satType, parent):
+    def __init__(self, filePaths, resultStates, satType, parent, settings=None):
 
         QgsTask.__init__(self, "Inputs Processor")
 
-        self.filePaths = filePaths
-        self.resultStates = resultStates
-        self.satType = satType
-        self.parent = parent
+        from . import engine
 
-        self.bands = dict()
-        self.filer = None
+        self.loader = engine.inputLoader(filePaths, resultStates, satType, parent, settings)
+        self.parent = parent
         self.error = None
 
     def run(self):
@@ -102,29 +112,9 @@ class preprocess(QgsTask):
         Main processing element, called every time Go is pressed
         """
 
-        self.filer = fileio.fileHandler()
-        self.parent.updateProgress(0, "0 % Starting, setting optional out folder")
-
-        if("output" in self.filePaths):
-            self.filer.prepareOutFolder(self.filePaths["output"])
-            del self.filePaths["output"]
-        
-        self.parent.updateProgress(5, "5 % Loading files")
-
-        if "zip" in self.filePaths:
-            self.bands = self.filer.loadZip(self.filePaths)
-            self.satType = self.bands["sat_type"]
-            del self.bands["sat_type"]
-        else:
-            self.bands = self.filer.loadBands(self.filePaths)
-        
-        self.parent.updateProgress(15, "15% Files ready, checking for errors")
-
-        if self.bands["Error"]:
-            self.error = self.bands["Error"]
-            return True
-        del self.bands["Error"]
-        return True
+        result = self.loader.run()
+        self.error = self.loader.error
+        return result
     
     def finished(self, results = None):
 
@@ -132,25 +122,28 @@ class preprocess(QgsTask):
         Called when complete or if interrupted.
         """
 
-        if(not(results)):
+        if(not(results) and not(self.error)):
             self.error = "Aborted"
         if(self.error):
             self.parent.setError(self.error)
-        self.parent.updateProgress(20, "20% Starting calculations")
+        self.parent.meter.step("load", 1, 1, "Starting calculations")
 
 class postprocess(QgsTask):
 
     """
-    This task saves outputs
+    This task saves outputs, see engine.outputSaver
     """
 
     def __init__(self, proc_object, parent):
 
         QgsTask.__init__(self, "Outputs Processor")
 
-        self.proc_object = proc_object
+        from . import engine
+
+        self.saver = engine.outputSaver(proc_object.engine, parent)
         self.parent = parent
         self.error = None
+        self.filer = None
     
     def run(self):
 
@@ -158,10 +151,10 @@ class postprocess(QgsTask):
         Main processing element, called when calculations are complete
         """
 
-        self.filer = self.proc_object.filer
-        self.filer.saveAll(self.proc_object.results)
-        self.parent.updateProgress(94, "94% Files Saved")
-        return True
+        result = self.saver.run()
+        self.filer = self.saver.filer
+        self.error = self.saver.error
+        return result
 
     def finished(self, results = None):
 
@@ -169,18 +162,20 @@ class postprocess(QgsTask):
         Called if interrupted or when results have been saved
         """
 
-        if(not(results)):
+        if(not(results) and not(self.error)):
             self.error = "Aborted"
         if(self.error):
             self.parent.setError(self.error)
         self.parent.done = True
-        self.parent.updateProgress(95, "95% Finished, Displaying Outputs")
+        self.parent.meter.step("save", 1, 1, "Finished, Displaying Outputs")
 
 class CarrierTask(QgsTask):
 
     """
     This task is a dummy, intended to manage its subtasks,
     i.e. preprocess, processor and postprocess.
+    The task manager runs them in order, and calls finished once all are
+    done, or as soon as one of them fails or is cancelled
     """
 
     def __init__(self, form):
@@ -189,26 +184,40 @@ class CarrierTask(QgsTask):
         self.error = None
         self.done = False
         self.notification = "If you're still seeing this, something's gone very wrong"
+        self.steps = []
+        self.recorder = instrument.stageRecorder()  ## Measurements of the stages
+        self.meter = instrument.workMeter(self.updateProgress)
+
+    def addStep(self, task, dependencies=[]):
+
+        """
+        Add a subtask, started once the tasks it depends on have succeeded
+        """
+
+        self.steps.append(task)
+        self.addSubTask(task, dependencies)
     
     def run(self):
 
         """
-        Do nothing, unless required to exit
+        Nothing to do, the subtasks do the work
+        Returns straight away, no thread is held while they run
         """
 
-        while(not(self.done) and not(self.error)):
-            time.sleep(1)
         return True
     
     def finished(self, result = None):
 
         """
-        Handle interruptions, close thread
+        Called once every subtask is done, or one of them has failed
         """
 
         self.setProgress(100)
-        if(not(result)):
-            self.error = "Crash"
+        self.recorder.stop()
+        if(not(result) and not(self.error)):
+            ## A failed subtask may not have reported yet
+            errors = [step.error for step in self.steps if step.error]
+            self.error = errors[0] if errors else "Crash"
         if(self.error):
             self.form.showError(self.error)
         self.form.endRun()
@@ -232,4 +241,4 @@ class CarrierTask(QgsTask):
             return
         self.error = msg
         self.done = True
-        self.finished(True)
+        self.cancel()  ## Subtasks still waiting are not started
@@ -0,0 +1,253 @@
+"""
+Every product and intermediate is held in the precision asked for, see
+engine.PRECISIONS. Needs numpy and GDAL, not QGIS. Run from the plugin folder:
+    python -m pytest tests
+"""
+
+import importlib, os, sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+pytest.importorskip("gdal")
+
+## The plugin is a package named after its folder
+PLUGIN = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN))
+engine = importlib.import_module(os.path.basename(PLUGIN) + ".engine")
+fileio = importlib.import_module(os.path.basename(PLUGIN) + ".fileio")
+
+KEYS = [key for key, name in engine.PRODUCTS]
+CALCULATIONS = ["calc_TOA", "calc_BT", "calc_NDVI", "calc_PV", "calc_LSE", "calc_LST"]
+
+
+def bands(dtype=np.float32, size=64):
+
+    """
+    Red, Near-IR and Thermal-IR digital numbers, some of them 0 (no data)
+    """
+
+    rng = np.random.RandomState(0)
+    r = rng.randint(1, 20000, (size, size))
+    nir = rng.randint(1, 20000, (size, size))
+    tir = rng.randint(20000, 35000, (size, size))
+    tir[:4] = 0
+    return r.astype(dtype), nir.astype(dtype), tir.astype(dtype)
+
+
+def required(keys):
+
+    return [(key in keys, key) for key in KEYS]
+
+
+@pytest.fixture(params=engine.PRECISIONS)
+def precision(request):
+
+    return request.param
+
+
+@pytest.mark.parametrize("tirType", [np.float32, np.uint16])
+def test_calculations(precision, tirType):
+
+    r, nir, tir = bands()
+    calc = engine.calculator(r, nir, tir.astype(tirType), "Landsat8", dtype=precision)
+    assert calc.r.dtype == calc.nir.dtype == np.dtype(precision)
+    for method in CALCULATIONS:
+        assert getattr(calc, method)() is None
+        for key in KEYS:
+            product = getattr(calc, key)
+            assert product.size == 0 or product.dtype == np.dtype(precision), (method, key)
+
+
+@pytest.mark.parametrize(
+    "keys", [["toa"], ["bt"], ["ndvi"], ["pv"], ["lse"], ["lst"], ["bt", "pv"], KEYS]
+)
+@pytest.mark.parametrize("tirType", [np.float32, np.uint16])
+def test_compute(precision, keys, tirType):
+
+    ## The planner releases intermediates, and lookups skip TOA
+    r, nir, tir = bands()
+    calc = engine.calculator(r, nir, tir.astype(tirType), "Landsat8", dtype=precision)
+    results, error = calc.compute(required(keys))
+    assert error is None
+    assert sorted(results) == sorted(keys)
+    for name in results:
+        assert results[name].dtype == np.dtype(precision), name
+
+
+@pytest.mark.parametrize(
+    "keys", [["toa"], ["bt"], ["ndvi"], ["pv"], ["lse"], ["lst"], ["toa", "lst"], KEYS]
+)
+@pytest.mark.parametrize("tirType", [np.float32, np.uint16])
+def test_computeFused(precision, keys, tirType):
+
+    r, nir, tir = bands(np.float64 if precision == "float32" else np.float32)
+    calc = engine.calculator(r, nir, tir.astype(tirType), "Landsat5", dtype=precision)
+    results, error = calc.computeFused(required(keys), engine.workspace())
+    assert error is None
+    assert sorted(results) == sorted(keys)
+    for name in results:
+        assert results[name].dtype == np.dtype(precision), name
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_pooled_strips(precision, fused):
+
+    proc = engine.sceneProcessor(None, required(KEYS), None)
+    proc.settings = {"workers": 2, "fused": fused}
+    proc.sat_type = "Landsat8"
+    proc.dtype = np.dtype(precision)
+    proc.pool = ThreadPoolExecutor(2)
+    try:
+        results, error = proc.calculate(*bands(), space=engine.workspace())
+    finally:
+        proc.pool.shutdown()
+    assert error is None
+    for name in results:
+        assert results[name].dtype == np.dtype(precision), name
+
+
+def test_aggregateMean(precision):
+
+    array = np.full((10, 7), 2.0, precision)
+    array[0, 0] = np.nan
+    out = engine.aggregateMean(array, 3)
+    assert out.dtype == np.dtype(precision)
+    assert out.shape == (4, 3)
+    assert np.all(out == 2)
+
+
+def test_expand(precision):
+
+    mask = np.array([[True, False], [False, True]])
+    out = fileio.fileHandler().expand(np.array([1, 2], precision), mask)
+    assert out.dtype == np.dtype(precision)
+    assert np.isnan(out[0, 1]) and out[1, 1] == 2
+
+
+class bandWriter(object):
+
+    """
+    Stands in for an open output dataset, keeping what is written
+    """
+
+    def __init__(self):
+
+        self.written = []
+
+    def GetRasterBand(self, band):
+
+        return self
+
+    def WriteArray(self, array, xoff=0, yoff=0):
+
+        self.written.append(array)
+
+
+@pytest.mark.parametrize("given", [np.float32, np.float64])
+def test_saveArray(precision, given):
+
+    filer = fileio.fileHandler()
+    filer.precision = precision
+    filer.outputs["out.TIF"] = output = bandWriter()
+    filer.saveArray(np.ones((3, 3), given), "out.TIF")
+    assert output.written[0].dtype == np.dtype(precision)
+
+
+def test_output_type(precision):
+
+    gdal = pytest.importorskip("gdal")
+    filer = fileio.fileHandler()
+    filer.precision = precision
+    filer.driver = gdal.GetDriverByName("MEM")
+    filer.rows, filer.cols = 4, 5
+    filer.geoTransform = (300000, 30, 0, 2500000, 0, -30)
+    filer.projection = ""
+    outDS = filer.createDataset("")
+    expected = gdal.GDT_Float64 if precision == "float64" else gdal.GDT_Float32
+    assert outDS.GetRasterBand(1).DataType == expected
+
+
+def test_seriesStatistics(precision):
+
+    stats = engine.seriesStatistics(4, 5, dtype=precision)
+    for value in (1.0 / 3, 2.0 / 3, np.nan):
+        stats.add(np.full((4, 5), value))
+    for name in engine.STATISTICS:
+        assert stats.statistic(name).dtype == np.dtype(precision), name
+    mean = stats.statistic("Mean")[0, 0]
+    assert (mean == np.float32(0.5)) if precision == "float32" else (mean == 0.5)
+
+
+class sceneLoader(object):
+
+    """
+    Stands in for inputLoader, with a scene of one value on a fixed grid
+    """
+
+    def __init__(self, filePaths, resultStates, satType, parent, settings):
+
+        self.filePaths = filePaths
+        self.satType = satType
+        self.error = None
+        self.bands = dict()
+        self.filer = fileio.fileHandler()
+        self.filer.driver = fileio.gdal.GetDriverByName("MEM")
+        self.filer.folder = "."
+        self.filer.rows, self.filer.cols = 3, 4
+        self.filer.geoTransform = (300000, 30, 0, 2500000, 0, -30)
+        self.filer.projection = ""
+
+    def run(self):
+
+        return True
+
+
+class sceneResults(object):
+
+    """
+    Stands in for sceneProcessor, the LST of a scene is its value
+    """
+
+    def __init__(self, loader, resultStates, parent):
+
+        self.loader = loader
+        self.error = None
+        self.compacted = None
+        self.space = engine.workspace()
+
+    def run(self):
+
+        value = np.float64(self.loader.filePaths["value"])
+        self.results = {"Land Surface Temperature": np.full((3, 4), value)}
+        return True
+
+
+def test_processSeries(precision, tmp_path, monkeypatch):
+
+    written = dict()
+
+    def openOutput(filer, fname, kinds=(None,), names=None):
+        filer.outputs[fname] = written[fname] = bandWriter()
+
+    monkeypatch.setattr(engine, "inputLoader", sceneLoader)
+    monkeypatch.setattr(engine, "sceneProcessor", sceneResults)
+    monkeypatch.setattr(fileio.fileHandler, "openOutput", openOutput)
+    monkeypatch.setattr(fileio.fileHandler, "closeOutput", lambda filer, fname: None)
+
+    batchModule = importlib.import_module(os.path.basename(PLUGIN) + ".batch")
+    parent = batchModule.consoleCarrier()
+    scenes = [({"value": 1.0 / 3}, "Landsat8"), ({"value": 2.0 / 3}, "Landsat8")]
+    summary = engine.processSeries(
+        scenes, "lst", {"precision": precision}, parent, str(tmp_path)
+    )
+    assert parent.error is None
+    assert [record["pixels"] for record in summary] == [12, 12]
+    (stack,) = written.values()
+    assert len(stack.written) == len(engine.STATISTICS)
+    for band in stack.written:
+        assert band.dtype == np.dtype(precision)
+    if precision == "float64":
+        ## Minimum, not widened from float32
+        assert stack.written[1][0, 0] == 1.0 / 3 != float(np.float32(1.0 / 3))